@@ -0,0 +1 @@
+"""Configuration for the AI Children's Story Generator."""
@@ -2,34 +2,66 @@
 Configuration settings for the AI Children's Story Generator.
 """
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+
+@lru_cache(maxsize=1)
+def _env():
+    """Load the .env file once and snapshot the resulting environment."""
+    # .env entries go into os.environ, so libraries that read their own settings
+    # (OPENAI_BASE_URL, OPENAI_ORG_ID, proxies, ...) see them; real environment
+    # variables take precedence
+    load_dotenv()
+    return dict(os.environ)
+
+
+def get_env(name, default=None):
+    """
+    Look up a configuration value from the environment or the .env file.
+    
+    Args:
+        name (str): Name of the variable
+        default (str, optional): Value returned when the variable is not set
+        
+    Returns:
+        str: The configured value, or the default
+    """
+    value = _env().get(name)
+    return default if value is None else value
+
 
 # Version information
 VERSION = "1.0.0"
 
 # API Configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_KEY = get_env("OPENAI_API_KEY")
+MAX_CONCURRENT_REQUESTS = 5  # Maximum OpenAI requests in flight when running several stories at once
+REQUESTS_PER_MINUTE = 500  # Request rate limit of the OpenAI account
 
 # Story Generation Settings
 STORY_MODEL = "gpt-4o"  # Model to use for story generation
 STORY_MAX_TOKENS = 2000  # Maximum tokens for story generation
 STORY_TEMPERATURE = 0.7  # Creativity level (0.0-1.0)
+STORY_NOCACHE = get_env("STORY_NOCACHE") == "1"  # Set STORY_NOCACHE=1 to always generate fresh stories in test runs
 
 # Image Generation Settings
 IMAGE_MODEL = "dall-e-3"  # Model to use for image generation
 IMAGE_SIZE = "1024x1024"  # Size of generated images
 IMAGE_QUALITY = "standard"  # Quality of generated images
 IMAGE_STYLE = "natural"  # Style of generated images
+SCENE_STORY_MAX_CHARS = 4000  # Longer stories are shortened to excerpts for scene extraction
 
 # Output Settings
 OUTPUT_DIR = "output"  # Directory to save generated stories and images
 IMAGES_PER_STORY = 4  # Number of images to generate per story
+CACHE_DIR = get_env("CACHE_DIR", os.path.join(OUTPUT_DIR, ".cache"))  # Directory for cached LLM responses
+CACHE_EXPIRE = 7 * 24 * 60 * 60  # Seconds until cached LLM responses expire (one week)
 
 # Content Safety
 CONTENT_FILTER = True  # Enable content filtering for child-appropriate content
+MODERATION_MODEL = "omni-moderation-latest"  # Model to use for AI content checks
+MODERATION_THRESHOLD = 0.5  # Category score above which content is unsuitable for children
 
 # Logging Configuration
 LOG_LEVEL = "INFO"  # Default logging level
@@ -6,12 +6,20 @@ This script packages the application for distribution.
 import os
 import sys
 import shutil
-import subprocess
+import runpy
 import platform
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 
+# Files larger than this are streamed into the archive instead of compressed in one piece
+STREAM_THRESHOLD = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
 def clean_build_directories():
     """Clean build and distribution directories."""
     print("Cleaning build directories...")
@@ -30,13 +38,139 @@ def create_package():
     """Create a Python package."""
     print("\nCreating Python package...")
     
+    # Run setup.py in this interpreter instead of paying for a second one to start up
+    old_argv = sys.argv
+    sys.argv = ["setup.py", "sdist", "bdist_wheel"]
     try:
-        subprocess.run([sys.executable, "setup.py", "sdist", "bdist_wheel"], check=True)
+        runpy.run_path("setup.py", run_name="__main__")
         print("Package created successfully.")
         return True
-    except subprocess.CalledProcessError as e:
+    except SystemExit as e:
+        # setuptools reports build failures by exiting
+        if e.code in (None, 0):
+            print("Package created successfully.")
+            return True
+        print(f"Error creating package: {e}")
+        return False
+    except Exception as e:
         print(f"Error creating package: {e}")
         return False
+    finally:
+        sys.argv = old_argv
+
+
+def _deflate_file(file_path):
+    """
+    Compress a file into a raw DEFLATE stream.
+    
+    Runs in a worker process so that several files are compressed in parallel.
+    
+    Args:
+        file_path (str): Path of the file to compress
+        
+    Returns:
+        tuple: (file_path, crc32, uncompressed_size, compressed_bytes)
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    
+    # Negative wbits produce a raw stream without zlib headers, as ZIP expects
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return file_path, zlib.crc32(data), len(data), compressed
+
+
+def _write_precompressed(zipf, file_path, crc, file_size, compressed):
+    """
+    Append an already deflated file to an open ZIP archive.
+    
+    Args:
+        zipf (zipfile.ZipFile): Archive opened for writing
+        file_path (str): Path of the original file
+        crc (int): CRC-32 of the uncompressed data
+        file_size (int): Size of the uncompressed data
+        compressed (bytes): Raw DEFLATE stream of the file
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = len(compressed)
+    zinfo.header_offset = zipf.fp.tell()
+    
+    zipf.fp.write(zinfo.FileHeader())
+    zipf.fp.write(compressed)
+    
+    # Register the entry so ZipFile.close() writes it to the central directory
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def _write_streamed(zipf, file_path):
+    """
+    Deflate a file into an open ZIP archive in fixed-size blocks.
+    
+    Args:
+        zipf (zipfile.ZipFile): Archive opened for writing
+        file_path (str): Path of the file to add
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    with open(file_path, "rb") as src, zipf.open(zinfo, "w") as dest:
+        shutil.copyfileobj(src, dest, CHUNK_SIZE)
+
+
+def _write_entry(zipf, entry):
+    """Write a pending archive entry: a compression future or a path to stream."""
+    if isinstance(entry, str):
+        _write_streamed(zipf, entry)
+    else:
+        _write_precompressed(zipf, *entry.result())
+
+
+def _collect_archive_files(include, exclude_names, exclude_suffixes):
+    """
+    Build the sorted list of files to archive in a single scandir pass.
+    
+    Files reachable through more than one include entry (or symlink) are listed once.
+    
+    Args:
+        include (list): Files and directories to include
+        exclude_names (frozenset): Exact file or directory names to skip
+        exclude_suffixes (tuple): Name suffixes to skip
+        
+    Returns:
+        list: Sorted paths of the files to archive
+    """
+    seen = set()
+    file_paths = []
+    
+    def add_file(path):
+        real_path = os.path.realpath(path)
+        if real_path not in seen:
+            seen.add(real_path)
+            file_paths.append(path)
+    
+    def walk(directory):
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name in exclude_names or entry.name.endswith(exclude_suffixes):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path)
+                elif entry.is_file():
+                    add_file(entry.path)
+    
+    for item in include:
+        if os.path.isfile(item):
+            add_file(item)
+        elif os.path.isdir(item):
+            walk(item)
+    
+    # Sorted order keeps related entries next to each other in the archive
+    file_paths.sort()
+    return file_paths
 
 
 def create_zip_archive():
@@ -76,21 +210,30 @@ def create_zip_archive():
         "*.egg-info"
     ]
     
+    # Split the patterns once into exact names and "*" suffix globs
+    exclude_names = frozenset(ex for ex in exclude if not ex.startswith("*"))
+    exclude_suffixes = tuple(frozenset(ex.lstrip("*") for ex in exclude if ex.startswith("*")))
+    
     try:
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for item in include:
-                if os.path.isfile(item):
-                    zipf.write(item)
-                elif os.path.isdir(item):
-                    for root, dirs, files in os.walk(item):
-                        # Skip excluded directories
-                        dirs[:] = [d for d in dirs if not any(d == ex or d.endswith(ex) for ex in exclude)]
-                        
-                        for file in files:
-                            # Skip excluded files
-                            if not any(file == ex or file.endswith(ex) for ex in exclude):
-                                file_path = os.path.join(root, file)
-                                zipf.write(file_path)
+        # Collect the files first so they can be compressed in parallel
+        file_paths = _collect_archive_files(include, exclude_names, exclude_suffixes)
+        
+        # Keep only a small window of compressed files in memory at any time
+        window = 2 * (os.cpu_count() or 1)
+        pending = deque()
+        
+        with ProcessPoolExecutor() as executor, zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for file_path in file_paths:
+                if os.path.getsize(file_path) > STREAM_THRESHOLD:
+                    pending.append(file_path)
+                else:
+                    pending.append(executor.submit(_deflate_file, file_path))
+                
+                if len(pending) >= window:
+                    _write_entry(zipf, pending.popleft())
+            
+            while pending:
+                _write_entry(zipf, pending.popleft())
         
         print(f"ZIP archive created: {zip_filename}")
         return True
@@ -8,9 +8,20 @@ import sys
 import subprocess
 import platform
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 
+# Local directory that requirements are downloaded into before installing
+WHEELHOUSE = ".wheelhouse"
+
+# Platform details, resolved once
+_IS_WINDOWS = platform.system() == "Windows"
+_VENV_BIN = Path("venv") / ("Scripts" if _IS_WINDOWS else "bin")
+_PIP = str(_VENV_BIN / "pip")
+_PYTHON = str(_VENV_BIN / "python")
+
+
 def check_python_version():
     """Check if Python version is 3.8 or higher."""
     required_version = (3, 8)
@@ -47,22 +58,79 @@ def create_virtual_environment():
         return False
 
 
+def run_pip_command(command, check=False):
+    """
+    Run a pip (or uv) command.
+    
+    The child needs none of this process's file descriptors, so the close_fds scan
+    that Popen performs before exec is skipped and the environment is passed as-is.
+    
+    Args:
+        command (list): Command and arguments to run
+        check (bool): Raise CalledProcessError on a non-zero exit status
+        
+    Returns:
+        subprocess.CompletedProcess: The finished process
+    """
+    return subprocess.run(command, check=check, close_fds=False, env=os.environ)
+
+
+def read_requirements(path="requirements.txt"):
+    """Read requirement specifiers, skipping blank lines and comments."""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def download_dependencies(pip_path, max_workers=8):
+    """
+    Download all requirements into the local wheelhouse in parallel.
+    
+    Each requirement is downloaded into its own subdirectory so that concurrent
+    downloads of shared dependencies never write the same file.
+    
+    Args:
+        pip_path (str): Path to the virtual environment's pip
+        max_workers (int): Maximum number of concurrent downloads
+        
+    Returns:
+        tuple: (list of download directories, True if every download succeeded)
+    """
+    requirements = read_requirements()
+    directories = [os.path.join(WHEELHOUSE, str(i)) for i in range(len(requirements))]
+    
+    def download(job):
+        requirement, directory = job
+        result = run_pip_command([pip_path, "download", "--quiet", "--dest", directory, requirement])
+        return result.returncode == 0
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(download, zip(requirements, directories)))
+    
+    return directories, all(results)
+
+
 def install_dependencies():
     """Install dependencies from requirements.txt."""
     print("\nInstalling dependencies...")
     
-    # Determine the pip executable path based on the OS
-    if platform.system() == "Windows":
-        pip_path = os.path.join("venv", "Scripts", "pip")
-    else:
-        pip_path = os.path.join("venv", "bin", "pip")
-    
     try:
         # Upgrade pip
-        subprocess.run([pip_path, "install", "--upgrade", "pip"], check=True)
+        run_pip_command([_PIP, "install", "--upgrade", "pip"], check=True)
         
-        # Install requirements
-        subprocess.run([pip_path, "install", "-r", "requirements.txt"], check=True)
+        uv_path = shutil.which("uv")
+        if uv_path:
+            # uv downloads and installs packages in parallel on its own
+            run_pip_command([uv_path, "pip", "install", "--python", _PYTHON, "-r", "requirements.txt"], check=True)
+        else:
+            # Fetch all packages concurrently, then install from the local copies
+            directories, downloaded = download_dependencies(_PIP)
+            command = [_PIP, "install", "-r", "requirements.txt"]
+            for directory in directories:
+                command += ["--find-links", directory]
+            if downloaded:
+                command.append("--no-index")
+            run_pip_command(command, check=True)
         
         print("Dependencies installed successfully.")
         return True
@@ -121,7 +189,7 @@ def print_activation_instructions():
     print("=" * 60)
     print("\nTo activate the virtual environment:")
     
-    if platform.system() == "Windows":
+    if _IS_WINDOWS:
         print("    venv\\Scripts\\activate")
     else:
         print("    source venv/bin/activate")
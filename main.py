@@ -6,16 +6,10 @@ import sys
 import os
 import logging
 import time
-from src.input_handler import InputHandler
-from src.story_generator import StoryGenerator
-from src.image_prompt_creator import ImagePromptCreator
-from src.image_generator import ImageGenerator
-from src.file_manager import FileManager
-from src.utils import setup_logging, print_colored
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import setup_logging, print_colored, ensure_story_title
 from src.cli import parse_arguments, print_welcome_message, list_generated_stories, show_version_info
-from src.content_filter import ContentFilter
-from src.performance_monitor import PerformanceMonitor
-from src.prompt_optimizer import PromptOptimizer
 from config.config import OPENAI_API_KEY, OUTPUT_DIR
 
 def check_api_key():
@@ -45,118 +39,178 @@ def generate_story(story_prompt=None, num_images=None, output_dir=None, verbose=
     Returns:
         tuple: (success, story_folder_path)
     """
+    # Import the generation modules here so that meta-commands such as --version and
+    # --list-stories do not pay for loading openai, psutil and friends
+    from src.input_handler import InputHandler
+    from src.story_generator import StoryGenerator
+    from src.image_prompt_creator import ImagePromptCreator, ABORT_EXTRACTION
+    from src.image_generator import ImageGenerator
+    from src.file_manager import FileManager
+    from src.content_filter import ContentFilter
+    from src.performance_monitor import (
+        PerformanceMonitor, PHASE_INPUT_HANDLING, PHASE_PROMPT_OPTIMIZATION,
+        PHASE_STORY_GENERATION, PHASE_CONTENT_FILTERING, PHASE_FILE_MANAGEMENT,
+        PHASE_IMAGE_PROMPT_CREATION, PHASE_IMAGE_PROMPT_OPTIMIZATION,
+        PHASE_IMAGE_PROMPT_FILTERING, PHASE_IMAGE_GENERATION, PHASE_MARKDOWN_UPDATE
+    )
+    from src.prompt_optimizer import PromptOptimizer
+    
     # Initialize performance monitoring
     monitor = PerformanceMonitor()
     monitor.start_monitoring()
     
-    # Initialize modules
-    input_handler = InputHandler()
-    story_generator = StoryGenerator(model=model, temperature=temperature)
-    image_prompt_creator = ImagePromptCreator()
-    image_generator = ImageGenerator(model=image_model)
-    file_manager = FileManager(custom_output_dir=output_dir)
-    content_filter = ContentFilter() if filter_content else None
-    prompt_optimizer = PromptOptimizer() if optimize_prompts else None
+    # Initialize modules; the API-backed ones are independent cold starts, so build them
+    # concurrently while the lightweight ones are set up on this thread
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        story_generator_future = executor.submit(StoryGenerator, model=model, temperature=temperature)
+        image_prompt_creator_future = executor.submit(ImagePromptCreator)
+        image_generator_future = executor.submit(ImageGenerator, model=image_model)
+        content_filter_future = executor.submit(ContentFilter) if filter_content else None
+        prompt_optimizer_future = executor.submit(PromptOptimizer) if optimize_prompts else None
+        
+        input_handler = InputHandler()
+        file_manager = FileManager(custom_output_dir=output_dir)
+    
+    story_generator = story_generator_future.result()
+    image_prompt_creator = image_prompt_creator_future.result()
+    image_generator = image_generator_future.result()
+    content_filter = content_filter_future.result() if content_filter_future else None
+    prompt_optimizer = prompt_optimizer_future.result() if prompt_optimizer_future else None
     
     try:
         # Get user input if not provided
-        monitor.start_operation("Input Handling")
-        if not story_prompt:
-            story_prompt = input_handler.get_story_prompt()
-        else:
-            # Validate the provided prompt
-            validation = input_handler.validate_input(story_prompt)
-            if not validation["valid"]:
-                logging.error(f"Invalid prompt: {validation['message']}")
-                print_colored(f"Error: {validation['message']}", "red")
-                monitor.end_operation("Input Handling")
-                return False, None
-        monitor.end_operation("Input Handling")
+        with monitor.phase(PHASE_INPUT_HANDLING):
+            if not story_prompt:
+                story_prompt = input_handler.get_story_prompt()
+            else:
+                # Validate the provided prompt
+                validation = input_handler.validate_input(story_prompt)
+                if not validation["valid"]:
+                    logging.error(f"Invalid prompt: {validation['message']}")
+                    print_colored(f"Error: {validation['message']}", "red")
+                    return False, None
         
         # Optimize the prompt if requested
         if optimize_prompts and prompt_optimizer:
-            monitor.start_operation("Prompt Optimization")
-            print_colored("Optimizing your prompt for better story quality...", "blue")
-            # For initial prompt, we'll use a simple enhancement
-            enhanced_prompt = story_prompt + " Make it engaging, educational, and appropriate for children ages 4-10 with clear scenes that would work well as illustrations."
-            story_prompt = enhanced_prompt
-            monitor.end_operation("Prompt Optimization")
+            with monitor.phase(PHASE_PROMPT_OPTIMIZATION):
+                print_colored("Optimizing your prompt for better story quality...", "blue")
+                # For initial prompt, we'll use a simple enhancement
+                enhanced_prompt = story_prompt + " Make it engaging, educational, and appropriate for children ages 4-10 with clear scenes that would work well as illustrations."
+                story_prompt = enhanced_prompt
         
         logging.info(f"Generating story with prompt: {story_prompt}")
         print_colored("\nGenerating your story. This may take a moment...", "blue")
         
+        # Stream the story and feed complete paragraphs to a background scene extractor,
+        # so the image-prompt request starts as soon as the story is finished and overlaps
+        # with content filtering and saving
+        paragraph_queue = queue.Queue()
+        streamed_chunks = []
+        pending_text = ""
+        
+        def feed_paragraphs(chunk):
+            nonlocal pending_text
+            streamed_chunks.append(chunk)
+            pending_text += chunk
+            while "\n\n" in pending_text:
+                paragraph, pending_text = pending_text.split("\n\n", 1)
+                if paragraph.strip():
+                    paragraph_queue.put(paragraph)
+        
+        scene_executor = ThreadPoolExecutor(max_workers=1)
+        scene_future = scene_executor.submit(
+            image_prompt_creator.extract_scenes_incremental,
+            iter(paragraph_queue.get, None),
+            num_images
+        )
+        
         # Generate the story
-        monitor.start_operation("Story Generation")
-        start_time = time.time()
-        story_text = story_generator.generate_story(story_prompt)
-        generation_time = time.time() - start_time
-        logging.info(f"Story generated in {generation_time:.2f} seconds")
-        monitor.end_operation("Story Generation")
+        with monitor.phase(PHASE_STORY_GENERATION):
+            start_time = time.time()
+            try:
+                story_text = story_generator.generate_story(story_prompt, on_chunk=feed_paragraphs)
+            except BaseException:
+                # Release the worker without sending a request for a partial story
+                paragraph_queue.put(ABORT_EXTRACTION)
+                raise
+            else:
+                # After an interrupted stream the story was generated again without
+                # streaming, so the streamed paragraphs are not worth a request
+                scenes_current = story_text == ensure_story_title("".join(streamed_chunks).strip())
+                if scenes_current:
+                    # Flush the trailing paragraph and let the worker send its request
+                    if pending_text.strip():
+                        paragraph_queue.put(pending_text)
+                    paragraph_queue.put(None)
+                else:
+                    paragraph_queue.put(ABORT_EXTRACTION)
+            finally:
+                scene_executor.shutdown(wait=False)
+            generation_time = time.time() - start_time
+            logging.info(f"Story generated in {generation_time:.2f} seconds")
         
         if verbose:
             print_colored(f"Story generation completed in {generation_time:.2f} seconds", "green")
         
         # Filter content if requested
         if filter_content and content_filter:
-            monitor.start_operation("Content Filtering")
-            print_colored("Checking content for child-appropriateness...", "blue")
-            check_result = content_filter.check_story_content(story_text)
-            
-            if not check_result["is_appropriate"]:
-                print_colored("Filtering inappropriate content...", "yellow")
-                if verbose:
-                    for issue in check_result["pattern_issues"]:
-                        print_colored(f"  - Found '{issue['word']}' in context: \"{issue['context']}\"", "yellow")
+            with monitor.phase(PHASE_CONTENT_FILTERING):
+                print_colored("Checking content for child-appropriateness...", "blue")
+                check_result = content_filter.check_story_content(story_text)
                 
-                story_text = content_filter.filter_story_content(story_text)
-                print_colored("Content filtering complete", "green")
-            else:
-                print_colored("Content check passed", "green")
-            
-            monitor.end_operation("Content Filtering")
+                if not check_result["is_appropriate"]:
+                    print_colored("Filtering inappropriate content...", "yellow")
+                    if verbose:
+                        for issue in check_result["pattern_issues"]:
+                            print_colored(f"  - Found '{issue.word}' in context: \"{issue.context}\"", "yellow")
+                    
+                    filtered_text = content_filter.filter_story_content(story_text, check_result)
+                    scenes_current = scenes_current and filtered_text == story_text
+                    story_text = filtered_text
+                    print_colored("Content filtering complete", "green")
+                else:
+                    print_colored("Content check passed", "green")
         
         # Extract title for folder creation
-        title_match = story_text.split('\n')[0]
+        title_match = story_text.partition('\n')[0]
         if title_match.startswith('# '):
             title = title_match[2:]
         else:
             title = "Children's Story"
         
-        # Create a folder for the story
-        monitor.start_operation("File Management")
-        story_folder = file_manager.create_story_folder(title)
-        logging.info(f"Created story folder: {story_folder}")
-        
-        # Save the story as markdown
-        markdown_path = file_manager.save_story_markdown(story_text, story_folder)
-        logging.info(f"Saved story to: {markdown_path}")
-        monitor.end_operation("File Management")
+        with monitor.phase(PHASE_FILE_MANAGEMENT):
+            # Create a folder for the story
+            story_folder = file_manager.create_story_folder(title)
+            logging.info(f"Created story folder: {story_folder}")
+            
+            # Save the story as markdown
+            markdown_path = file_manager.save_story_markdown(story_text, story_folder)
+            logging.info(f"Saved story to: {markdown_path}")
         
         print_colored("\nCreating image prompts from your story...", "blue")
         
         # Extract scenes for image generation
-        monitor.start_operation("Image Prompt Creation")
-        start_time = time.time()
-        image_prompts = image_prompt_creator.extract_scenes(story_text, num_images)
-        extraction_time = time.time() - start_time
-        logging.info(f"Extracted {len(image_prompts)} image prompts in {extraction_time:.2f} seconds")
-        monitor.end_operation("Image Prompt Creation")
+        with monitor.phase(PHASE_IMAGE_PROMPT_CREATION):
+            start_time = time.time()
+            if scenes_current:
+                image_prompts = scene_future.result()
+            else:
+                # The story was rewritten (content filtering or an interrupted stream), so extract again
+                image_prompts = image_prompt_creator.extract_scenes(story_text, num_images)
+            extraction_time = time.time() - start_time
+            logging.info(f"Extracted {len(image_prompts)} image prompts in {extraction_time:.2f} seconds")
         
         # Optimize image prompts if requested
         if optimize_prompts and prompt_optimizer:
-            monitor.start_operation("Image Prompt Optimization")
-            print_colored("Optimizing image prompts for better quality...", "blue")
-            image_prompts = prompt_optimizer.optimize_image_prompts(story_text, image_prompts)
-            monitor.end_operation("Image Prompt Optimization")
+            with monitor.phase(PHASE_IMAGE_PROMPT_OPTIMIZATION):
+                print_colored("Optimizing image prompts for better quality...", "blue")
+                # The story analysis comes back with the optimized prompts in the same request
+                analysis, image_prompts = prompt_optimizer.analyze_and_optimize(story_text, story_prompt, image_prompts)
         
         # Filter image prompts if requested
         if filter_content and content_filter:
-            monitor.start_operation("Image Prompt Filtering")
-            filtered_prompts = []
-            for prompt in image_prompts:
-                filtered_prompts.append(content_filter.filter_image_prompt(prompt))
-            image_prompts = filtered_prompts
-            monitor.end_operation("Image Prompt Filtering")
+            with monitor.phase(PHASE_IMAGE_PROMPT_FILTERING):
+                image_prompts = content_filter.filter_image_prompts_batch(image_prompts)
         
         if verbose:
             print_colored(f"Created {len(image_prompts)} image prompts in {extraction_time:.2f} seconds", "green")
@@ -166,21 +220,19 @@ def generate_story(story_prompt=None, num_images=None, output_dir=None, verbose=
         print_colored(f"\nGenerating {len(image_prompts)} images for your story...", "blue")
         
         # Generate images
-        monitor.start_operation("Image Generation")
-        start_time = time.time()
-        image_paths = image_generator.generate_images(image_prompts, story_folder)
-        image_time = time.time() - start_time
-        logging.info(f"Generated {len(image_paths)} images in {image_time:.2f} seconds")
-        monitor.end_operation("Image Generation")
+        with monitor.phase(PHASE_IMAGE_GENERATION):
+            start_time = time.time()
+            image_paths = image_generator.generate_images(image_prompts, story_folder)
+            image_time = time.time() - start_time
+            logging.info(f"Generated {len(image_paths)} images in {image_time:.2f} seconds")
         
         if verbose:
             print_colored(f"Generated {len(image_paths)} images in {image_time:.2f} seconds", "green")
         
         # Update the markdown with images
-        monitor.start_operation("Markdown Update")
-        file_manager.update_markdown_with_images(markdown_path, image_paths)
-        logging.info(f"Updated markdown with {len(image_paths)} images")
-        monitor.end_operation("Markdown Update")
+        with monitor.phase(PHASE_MARKDOWN_UPDATE):
+            file_manager.update_markdown_with_images(markdown_path, image_paths)
+            logging.info(f"Updated markdown with {len(image_paths)} images")
         
         # Save performance data
         monitor.stop_monitoring()
@@ -189,7 +241,6 @@ def generate_story(story_prompt=None, num_images=None, output_dir=None, verbose=
         
         # If prompt optimization was used, save analysis
         if optimize_prompts and prompt_optimizer:
-            analysis = prompt_optimizer.analyze_story_quality(story_text, story_prompt)
             prompt_optimizer.save_optimization_results(analysis, story_prompt, story_text, performance_dir)
             
             if verbose:
@@ -218,6 +269,15 @@ def generate_story(story_prompt=None, num_images=None, output_dir=None, verbose=
 
 def main():
     """Main function to run the story generator with command-line arguments."""
+    # Answer single-flag meta-commands without building the argument parser
+    if len(sys.argv) == 2:
+        if sys.argv[1] == "--version":
+            show_version_info()
+            return 0
+        if sys.argv[1] == "--list-stories":
+            list_generated_stories(OUTPUT_DIR)
+            return 0
+    
     # Parse command-line arguments
     args = parse_arguments()
     
@@ -236,7 +296,7 @@ def main():
     # Handle test mode
     if args.test:
         from src.test_app import run_tests
-        run_tests(save_results=True, verbose=args.verbose)
+        run_tests(save_results=True, verbose=args.verbose, optimize_prompts=args.optimize)
         return 0
     
     # Print welcome message
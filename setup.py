@@ -15,7 +15,8 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/yourusername/story-generator",
-    packages=find_packages(),
+    packages=find_packages(include=["src", "config"]),
+    py_modules=["main"],
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1 @@
+"""Source modules for the AI Children's Story Generator."""
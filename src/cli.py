@@ -5,9 +5,38 @@ import sys
 import os
 import argparse
 import logging
-from src.utils import print_colored, setup_logging
+from datetime import datetime
+from functools import lru_cache
+from src.utils import COLORS, colors_enabled, print_colored, setup_logging
 from config.config import VERSION
 
+# The welcome banner only depends on the version, so it is rendered once per output setup
+_WELCOME_TEXT = f"""
+    ╔═══════════════════════════════════════════════╗
+    ║                                               ║
+    ║       AI Children's Story Generator           ║
+    ║                 v{VERSION:<8}                     ║
+    ║                                               ║
+    ╚═══════════════════════════════════════════════╝
+    """
+
+
+@lru_cache(maxsize=4)
+def _render_banner(colored, encoding):
+    """
+    Render the welcome banner as text and as encoded bytes.
+    
+    Args:
+        colored (bool): Whether to wrap the banner in color codes
+        encoding (str): Encoding of the output stream
+        
+    Returns:
+        tuple: (banner text, banner bytes)
+    """
+    text = f"{COLORS['cyan']}{_WELCOME_TEXT}{COLORS['reset']}\n" if colored else f"{_WELCOME_TEXT}\n"
+    return text, text.encode(encoding, errors="replace")
+
+
 def parse_arguments():
     """
     Parse command-line arguments.
@@ -62,15 +91,20 @@ def parse_arguments():
 
 def print_welcome_message():
     """Print welcome message with ASCII art."""
-    welcome_text = f"""
-    ╔═══════════════════════════════════════════════╗
-    ║                                               ║
-    ║       AI Children's Story Generator           ║
-    ║                 v{VERSION:<8}                     ║
-    ║                                               ║
-    ╚═══════════════════════════════════════════════╝
-    """
-    print_colored(welcome_text, "cyan")
+    stdout = sys.stdout
+    if stdout is None:
+        return
+    
+    text, data = _render_banner(colors_enabled(), getattr(stdout, "encoding", None) or "utf-8")
+    stream = getattr(stdout, "buffer", None)
+    if stream is None:
+        # stdout has been replaced by a text-only stream
+        stdout.write(text)
+        return
+    
+    stdout.flush()  # Keep ordering with any text already written
+    stream.write(data)
+    stream.flush()
 
 def list_generated_stories(output_dir):
     """
@@ -83,39 +117,42 @@ def list_generated_stories(output_dir):
         print_colored(f"Output directory not found: {output_dir}", "yellow")
         return
     
-    # Get all subdirectories in the output directory
-    story_folders = [d for d in os.listdir(output_dir) 
-                    if os.path.isdir(os.path.join(output_dir, d))]
+    # Get all subdirectories in the output directory, skipping hidden ones such as the
+    # LLM cache; DirEntry caches the stat result
+    with os.scandir(output_dir) as it:
+        story_folders = [entry for entry in it if entry.is_dir() and not entry.name.startswith('.')]
     
     if not story_folders:
         print_colored("No stories found.", "yellow")
         return
     
     # Sort by creation time (newest first)
-    story_folders.sort(key=lambda d: os.path.getctime(os.path.join(output_dir, d)), reverse=True)
+    story_folders.sort(key=lambda entry: entry.stat().st_ctime, reverse=True)
     
     print_colored(f"\nFound {len(story_folders)} stories:", "green")
     print_colored("=" * 60, "blue")
     
     for i, folder in enumerate(story_folders, 1):
-        folder_path = os.path.join(output_dir, folder)
-        creation_time = os.path.getctime(folder_path)
-        
-        # Find markdown files
-        md_files = [f for f in os.listdir(folder_path) if f.endswith('.md')]
+        creation_time = folder.stat().st_ctime
         
-        # Find image files
-        image_files = [f for f in os.listdir(folder_path) 
-                      if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        # Find markdown files and count images in a single directory pass
+        md_files = []
+        image_count = 0
+        with os.scandir(folder.path) as it:
+            for entry in it:
+                name = entry.name
+                if name.endswith('.md'):
+                    md_files.append(name)
+                elif name.lower().endswith(('.png', '.jpg', '.jpeg')):
+                    image_count += 1
         
         # Print story information
-        from datetime import datetime
         time_str = datetime.fromtimestamp(creation_time).strftime('%Y-%m-%d %H:%M:%S')
         
-        print_colored(f"{i}. {folder}", "cyan")
+        print_colored(f"{i}. {folder.name}", "cyan")
         print(f"   Created: {time_str}")
         print(f"   Story file: {md_files[0] if md_files else 'None'}")
-        print(f"   Images: {len(image_files)}")
+        print(f"   Images: {image_count}")
         print_colored("   " + "-" * 56, "blue")
     
     print_colored("=" * 60, "blue")
@@ -123,15 +160,16 @@ def list_generated_stories(output_dir):
 def show_version_info():
     """Show detailed version information."""
     import platform
-    import openai
+    from importlib.metadata import version, PackageNotFoundError
     
     print_colored(f"\nAI Children's Story Generator v{VERSION}", "cyan")
     print(f"Python version: {platform.python_version()}")
     print(f"Operating system: {platform.system()} {platform.release()}")
     
+    # Read the installed version from package metadata; importing openai is slow
     try:
-        print(f"OpenAI library version: {openai.__version__}")
-    except (ImportError, AttributeError):
+        print(f"OpenAI library version: {version('openai')}")
+    except PackageNotFoundError:
         print("OpenAI library: Unknown version")
     
     print("\nCreated by: Your Name")
@@ -3,71 +3,184 @@ Module for filtering and ensuring child-appropriate content in stories and image
 """
 import re
 import logging
-import sys
-from pathlib import Path
-from openai import OpenAI
+from collections import namedtuple
+from functools import lru_cache
+from itertools import chain
 
-# Add project root to path for imports
-sys.path.append(str(Path(__file__).parent.parent))
+from config.config import STORY_MODEL, MODERATION_MODEL, MODERATION_THRESHOLD, CACHE_EXPIRE
+from src.llm_cache import LLMCache, make_key
+from src.openai_client import get_client
+from src.prompt_utils import apply_safety_wrapper
 
-from config.config import OPENAI_API_KEY, STORY_MODEL
+# A single inappropriate word found in a text
+Issue = namedtuple("Issue", "word context position category")
+
+_FILTER_SYSTEM_PROMPT = """
+    You are an expert children's content editor. Your task is to rewrite sections of a children's story 
+    to make them age-appropriate while maintaining the story's meaning and flow.
+    
+    Rewrite the story to:
+    1. Remove or replace any inappropriate content
+    2. Use child-friendly language
+    3. Maintain the original story's message and theme
+    4. Keep the same characters and basic plot
+    5. Ensure the story remains engaging and educational
+    
+    Return ONLY the rewritten story, with no explanations or notes.
+    """
+
+_IMAGE_FILTER_SYSTEM_PROMPT = """
+    You are an expert editor of prompts for children's book illustrations. Your task is to rewrite
+    an image prompt so that the illustration is appropriate for children ages 4-10.
+    
+    Rewrite the prompt to:
+    1. Remove or replace any inappropriate content
+    2. Keep the same characters, setting and action where they are appropriate
+    3. Keep any style instructions
+    4. Stay a short description of a single picture
+    
+    Return ONLY the rewritten image prompt, with no explanations or notes.
+    """
 
 
 class ContentFilter:
+    # Define inappropriate content patterns, one per category
+    INAPPROPRIATE_PATTERNS = (
+        r'\b(kill|murder|dead|death|die|dying|blood|bloody|gore|violent|violence)\b',
+        r'\b(sex|sexual|sexy|nude|naked|explicit|porn|adult|nsfw)\b',
+        r'\b(drug|drugs|alcohol|drunk|cigarette|smoking|weed|cocaine|heroin)\b',
+        r'\b(gun|guns|weapon|weapons|knife|knives|shoot|shooting)\b',
+        r'\b(swear|damn|hell|ass|crap|shit|fuck|bitch|bastard)\b'
+    )
+    INAPPROPRIATE_CATEGORIES = ("violence", "sexual", "substances", "weapons", "language")
+    
+    # Define replacement words for common inappropriate terms
+    REPLACEMENTS = {
+        'kill': 'stop',
+        'die': 'go away',
+        'dead': 'gone',
+        'blood': 'water',
+        'gun': 'tool',
+        'weapon': 'item',
+        'knife': 'utensil',
+        'shoot': 'point',
+        'hell': 'heck',
+        'damn': 'darn',
+        'ass': 'donkey',
+        'crap': 'stuff',
+    }
+    
+    # Compiled once at import: a single alternation scans the text in one pass
+    # instead of once per pattern / replacement word
+    _INAPPROPRIATE_RE = re.compile(
+        "|".join(f"(?P<g{i}>{pattern})" for i, pattern in enumerate(INAPPROPRIATE_PATTERNS)),
+        re.IGNORECASE
+    )
+    _REPLACEMENTS_CI = {word.lower(): replacement for word, replacement in REPLACEMENTS.items()}
+    _REPLACEMENT_RE = re.compile(
+        r'\b(' + '|'.join(map(re.escape, REPLACEMENTS)) + r')\b',
+        re.IGNORECASE
+    )
+    
     def __init__(self):
         """Initialize the content filter."""
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = get_client()
         self.model = STORY_MODEL
-        
-        # Define inappropriate content patterns
-        self.inappropriate_patterns = [
-            r'\b(kill|murder|dead|death|die|dying|blood|bloody|gore|violent|violence)\b',
-            r'\b(sex|sexual|sexy|nude|naked|explicit|porn|adult|nsfw)\b',
-            r'\b(drug|drugs|alcohol|drunk|cigarette|smoking|weed|cocaine|heroin)\b',
-            r'\b(gun|guns|weapon|weapons|knife|knives|shoot|shooting)\b',
-            r'\b(swear|damn|hell|ass|crap|shit|fuck|bitch|bastard)\b'
-        ]
-        
-        # Define replacement words for common inappropriate terms
-        self.replacements = {
-            'kill': 'stop',
-            'die': 'go away',
-            'dead': 'gone',
-            'blood': 'water',
-            'gun': 'tool',
-            'weapon': 'item',
-            'knife': 'utensil',
-            'shoot': 'point',
-            'hell': 'heck',
-            'damn': 'darn',
-            'ass': 'donkey',
-            'crap': 'stuff',
-        }
+        self._check_cache = LLMCache("content_check")
+        self._filter_cache = LLMCache("content_filter")
     
-    def check_story_content(self, story_text):
+    def check_story_content(self, story_text, skip_ai=False):
         """
         Check if story content is appropriate for children.
         
         Args:
             story_text (str): The story text to check
+            skip_ai (bool): Whether to rely on the pattern check only
             
         Returns:
             dict: Results of the content check
         """
+        # Nothing to check in empty or trivially short text
+        if len(story_text) < 3 or not story_text.strip():
+            return {"is_appropriate": True, "pattern_issues": [], "ai_check": self._skipped_ai_check()}
+        
         # Check for inappropriate patterns
-        issues = []
-        for pattern in self.inappropriate_patterns:
-            matches = re.finditer(pattern, story_text, re.IGNORECASE)
-            for match in matches:
-                issues.append({
-                    "word": match.group(),
-                    "context": story_text[max(0, match.start() - 20):min(len(story_text), match.end() + 20)],
-                    "position": match.start()
-                })
+        issues = self._find_issues(story_text)
         
         # Use AI to check for subtle inappropriate content
-        ai_check_result = self._ai_content_check(story_text)
+        ai_check_result = self._skipped_ai_check() if skip_ai else self._ai_content_check(story_text)
+        
+        return self._build_check_result(issues, ai_check_result)
+    
+    def check_story_content_batch(self, texts):
+        """
+        Check several stories for child-appropriateness with a single AI request.
+        
+        Args:
+            texts (list): The story texts to check
+            
+        Returns:
+            list: Results of the content checks, in the same order as texts
+        """
+        ai_check_results = self._ai_content_check_batch(texts)
+        return [
+            self._build_check_result(self._find_issues(text), ai_check_result)
+            for text, ai_check_result in zip(texts, ai_check_results)
+        ]
+    
+    def _find_issues(self, text):
+        """
+        Find inappropriate words in the text.
+        
+        Args:
+            text (str): The text to check
+            
+        Returns:
+            list: Issue tuples found, in text order
+        """
+        length = len(text)
+        return [self._make_issue(match, text, length) for match in self._INAPPROPRIATE_RE.finditer(text)]
+    
+    def _make_issue(self, match, text, length):
+        """
+        Build an Issue from a match of the inappropriate-word pattern.
         
+        Args:
+            match (re.Match): The match
+            text (str): The text that was searched
+            length (int): Length of the text
+            
+        Returns:
+            Issue: The word, surrounding context, position and category
+        """
+        start, end = match.span()
+        return Issue(
+            match.group(),
+            text[max(0, start - 20):min(length, end + 20)],
+            start,
+            self.INAPPROPRIATE_CATEGORIES[int(match.lastgroup[1:])]
+        )
+    
+    def _skipped_ai_check(self):
+        """
+        Get the AI content check result used when the AI check is not run.
+        
+        Returns:
+            dict: A passing AI content check marked as skipped
+        """
+        return {"is_appropriate": True, "issues": [], "explanation": "skipped"}
+    
+    def _build_check_result(self, issues, ai_check_result):
+        """
+        Combine pattern issues and the AI check into a content check result.
+        
+        Args:
+            issues (list): Pattern issues found in the text
+            ai_check_result (dict): Results of the AI content check
+            
+        Returns:
+            dict: Results of the content check
+        """
         result = {
             "is_appropriate": len(issues) == 0 and ai_check_result["is_appropriate"],
             "pattern_issues": issues,
@@ -80,67 +193,128 @@ class ContentFilter:
         
         return result
     
-    def filter_story_content(self, story_text):
+    def filter_story_content(self, story_text, check_result=None):
         """
         Filter inappropriate content from story text.
         
         Args:
             story_text (str): The story text to filter
+            check_result (dict, optional): Result of a previous check_story_content
+                call on the same text, reused instead of checking again
             
         Returns:
             str: Filtered story text
         """
-        # Replace inappropriate words
-        filtered_text = story_text
-        for word, replacement in self.replacements.items():
-            pattern = r'\b' + re.escape(word) + r'\b'
-            filtered_text = re.sub(pattern, replacement, filtered_text, flags=re.IGNORECASE)
+        # Replace inappropriate words and collect issues in a single pass
+        filtered_text, issues = self._scan_and_rewrite(story_text)
         
-        # Check if further AI filtering is needed
-        check_result = self.check_story_content(filtered_text)
-        if not check_result["is_appropriate"]:
+        if self._needs_ai(issues, check_result):
             # Use AI to rewrite problematic sections
-            filtered_text = self._ai_content_filter(filtered_text, check_result)
+            ai_check = check_result.get("ai_check", {}) if check_result else {}
+            remaining = [issue for issue in issues if issue.word.lower() not in self._REPLACEMENTS_CI]
+            filtered_text = self._ai_content_filter(filtered_text, {"pattern_issues": remaining, "ai_check": ai_check})
         
         return filtered_text
     
-    def filter_image_prompt(self, prompt):
+    def filter_image_prompt(self, prompt, skip_ai=False):
         """
         Filter and enhance image prompt to ensure child-appropriate content.
         
         Args:
             prompt (str): The image prompt to filter
+            skip_ai (bool): Whether to rely on word replacements only
             
         Returns:
             str: Filtered and enhanced image prompt
         """
-        # Replace inappropriate words
-        filtered_prompt = prompt
-        for word, replacement in self.replacements.items():
-            pattern = r'\b' + re.escape(word) + r'\b'
-            filtered_prompt = re.sub(pattern, replacement, filtered_prompt, flags=re.IGNORECASE)
-        
-        # Add safety instructions
-        safety_instructions = (
-            "Create a child-friendly, G-rated illustration suitable for young children. "
-            "Use bright, cheerful colors and a non-threatening style. "
-            "Ensure all content is age-appropriate for children ages 4-10. "
-        )
+        return self.filter_image_prompts_batch([prompt], skip_ai=skip_ai)[0]
+    
+    def filter_image_prompts_batch(self, prompts, skip_ai=False):
+        """
+        Filter and enhance several image prompts at once.
+        
+        All prompts are sent to the moderation endpoint in a single request, and
+        only the flagged ones are rewritten as image prompts before adding safety
+        instructions. Prompts that cannot be rewritten, or could not be checked
+        because the moderation request failed, keep their word replacements.
+        
+        Args:
+            prompts (list): The image prompts to filter
+            skip_ai (bool): Whether to rely on word replacements only, without the
+                moderation request and rewrites
+            
+        Returns:
+            list: Filtered and enhanced image prompts, in the same order
+        """
+        filtered_prompts = [self._replace_prompt_words(prompt) for prompt in prompts]
+        run_ai = filtered_prompts and not skip_ai
+        ai_check_results = self._ai_content_check_batch(filtered_prompts) if run_ai else []
+        
+        for i, ai_check_result in enumerate(ai_check_results):
+            # When moderation is down, the rewrite requests would most likely fail too,
+            # so unchecked prompts rely on the word replacements and safety wrapper
+            if not ai_check_result["is_appropriate"] and not ai_check_result.get("unchecked"):
+                filtered_prompts[i] = self._ai_image_prompt_filter(filtered_prompts[i], ai_check_result)
+        
+        return [apply_safety_wrapper(prompt) for prompt in filtered_prompts]
+    
+    def _scan_and_rewrite(self, text):
+        """
+        Find inappropriate words and replace them in one pass over the text.
+        
+        Args:
+            text (str): The text to scan
+            
+        Returns:
+            tuple: (rewritten text, list of issues found in the original text)
+        """
+        issues = []
+        length = len(text)
+        
+        def rewrite(match):
+            issue = self._make_issue(match, text, length)
+            issues.append(issue)
+            return self._REPLACEMENTS_CI.get(issue.word.lower(), issue.word)
         
-        # Check if the prompt already has style instructions
-        if "style:" in filtered_prompt.lower() or "style=" in filtered_prompt.lower():
-            # Insert safety instructions before style instructions
-            parts = filtered_prompt.split("Style:", 1) if "Style:" in filtered_prompt else filtered_prompt.split("style:", 1)
-            enhanced_prompt = parts[0] + safety_instructions + "Style:" + parts[1]
-        else:
-            # Add safety instructions and style guidance
-            enhanced_prompt = safety_instructions + filtered_prompt + " Style: children's book illustration, colorful, whimsical."
+        return self._INAPPROPRIATE_RE.sub(rewrite, text), issues
+    
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _replace_prompt_words(prompt):
+        """
+        Replace inappropriate words in an image prompt with child-friendly alternatives.
+        
+        Only depends on the prompt and the class constants, so results are memoized;
+        storybooks often repeat the same character descriptions.
+        
+        Args:
+            prompt (str): The image prompt to filter
+            
+        Returns:
+            str: Prompt with replacements applied
+        """
+        return ContentFilter._REPLACEMENT_RE.sub(
+            lambda m: ContentFilter._REPLACEMENTS_CI[m.group(1).lower()], prompt
+        )
+    
+    def _needs_ai(self, issues, check_result=None):
+        """
+        Decide whether the AI rewrite is needed after the regex pass.
         
-        return enhanced_prompt
+        Args:
+            issues (list): Issues found by _scan_and_rewrite
+            check_result (dict, optional): Result of a previous content check
+            
+        Returns:
+            bool: True if some issues have no replacement or the AI check failed
+        """
+        if check_result and not check_result.get("ai_check", {}).get("is_appropriate", True):
+            return True
+        return any(issue.word.lower() not in self._REPLACEMENTS_CI for issue in issues)
     
     def _ai_content_check(self, text):
         """
-        Use AI to check for subtle inappropriate content.
+        Use OpenAI's moderation endpoint to check for subtle inappropriate content.
         
         Args:
             text (str): The text to check
@@ -148,50 +322,77 @@ class ContentFilter:
         Returns:
             dict: Results of the AI content check
         """
-        system_prompt = """
-        You are a content moderator for children's stories. Your task is to analyze a story and determine 
-        if it contains any content that would be inappropriate for children ages 4-10.
-        
-        Check for:
-        1. Violence or scary content
-        2. Adult themes or sexual content
-        3. Inappropriate language
-        4. Harmful stereotypes or prejudice
-        5. Dangerous behaviors children might imitate
-        
-        Return a JSON object with the following fields:
-        - is_appropriate: boolean (true if appropriate, false if not)
-        - issues: array of specific issues found (empty if none)
-        - explanation: brief explanation of your decision
+        return self._ai_content_check_batch([text])[0]
+    
+    def _ai_content_check_batch(self, texts):
         """
+        Use OpenAI's moderation endpoint to check several texts in one request.
         
-        user_prompt = f"""
-        Please analyze this children's story for age-appropriateness:
+        Cached texts are not sent again.
         
-        {text}
+        Args:
+            texts (list): The texts to check
+            
+        Returns:
+            list: Results of the AI content checks, in the same order as texts
         """
+        keys = [make_key(MODERATION_MODEL, text) for text in texts]
+        results = [self._check_cache.get(key) for key in keys]
+        
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            logging.debug("Using cached AI content checks")
+            return results
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"}
+            response = self.client.moderations.create(
+                model=MODERATION_MODEL,
+                input=[texts[i] for i in pending]
             )
             
-            import json
-            result = json.loads(response.choices[0].message.content)
-            return result
+            for i, moderation in zip(pending, response.results):
+                results[i] = self._moderation_to_check(moderation)
+                self._check_cache.set(keys[i], results[i], expire=CACHE_EXPIRE)
             
         except Exception as e:
+            # Fail closed: unchecked texts count as inappropriate, so stories are still
+            # rewritten. These results are not cached, so the next call checks again
             logging.error(f"Error in AI content check: {str(e)}")
-            return {
-                "is_appropriate": False,
-                "issues": ["Error performing AI content check"],
-                "explanation": f"Error: {str(e)}"
-            }
+            for i in pending:
+                results[i] = {
+                    "is_appropriate": False,
+                    "unchecked": True,
+                    "issues": ["unchecked: error performing AI content check"],
+                    "explanation": f"Error: {str(e)}"
+                }
+        
+        return results
+    
+    def _moderation_to_check(self, moderation):
+        """
+        Convert a moderation result into the AI content check format.
+        
+        Categories scoring above MODERATION_THRESHOLD count as issues even when the
+        endpoint did not flag them, as the endpoint's own thresholds target adults.
+        
+        Args:
+            moderation: A single result from the moderation endpoint
+            
+        Returns:
+            dict: Results of the AI content check
+        """
+        categories = moderation.categories.model_dump(by_alias=True)
+        scores = moderation.category_scores.model_dump(by_alias=True)
+        issues = [
+            name for name, flagged in categories.items()
+            if flagged or (scores.get(name) or 0) > MODERATION_THRESHOLD
+        ]
+        
+        return {
+            "is_appropriate": not issues,
+            "issues": issues,
+            "explanation": f"Moderation flagged: {', '.join(issues)}" if issues else "No moderation categories flagged"
+        }
     
     def _ai_content_filter(self, text, check_result):
         """
@@ -204,38 +405,66 @@ class ContentFilter:
         Returns:
             str: Filtered text
         """
-        system_prompt = """
-        You are an expert children's content editor. Your task is to rewrite sections of a children's story 
-        to make them age-appropriate while maintaining the story's meaning and flow.
+        # Create a prompt that highlights the issues
+        issue_descriptions = "\n".join(chain(
+            (f"- '{issue.word}' in context: \"{issue.context}\"" for issue in check_result.get("pattern_issues", [])),
+            (f"- {issue}" for issue in check_result.get("ai_check", {}).get("issues", []) if isinstance(issue, str))
+        ))
         
-        Rewrite the story to:
-        1. Remove or replace any inappropriate content
-        2. Use child-friendly language
-        3. Maintain the original story's message and theme
-        4. Keep the same characters and basic plot
-        5. Ensure the story remains engaging and educational
+        user_prompt = f"""
+        Please rewrite this children's story to make it age-appropriate for children ages 4-10.
         
-        Return ONLY the rewritten story, with no explanations or notes.
+        The following issues need to be addressed:
+        {issue_descriptions}
+        
+        Original story:
+        {text}
         """
         
-        # Create a prompt that highlights the issues
-        issue_descriptions = []
-        for issue in check_result.get("pattern_issues", []):
-            issue_descriptions.append(f"- '{issue['word']}' in context: \"{issue['context']}\"")
+        return self._ai_rewrite(_FILTER_SYSTEM_PROMPT, user_prompt, text)
+    
+    def _ai_image_prompt_filter(self, prompt, ai_check):
+        """
+        Use AI to rewrite an image prompt flagged by the moderation check.
         
-        for issue in check_result.get("ai_check", {}).get("issues", []):
-            if isinstance(issue, str):
-                issue_descriptions.append(f"- {issue}")
+        Args:
+            prompt (str): The image prompt, with word replacements applied
+            ai_check (dict): Results of the AI content check of the prompt
+            
+        Returns:
+            str: Rewritten image prompt, or the given prompt if the rewrite fails
+        """
+        issue_descriptions = "\n".join(f"- {issue}" for issue in ai_check.get("issues", []))
         
         user_prompt = f"""
-        Please rewrite this children's story to make it age-appropriate for children ages 4-10.
+        Please rewrite this image prompt for a children's book illustration.
         
         The following issues need to be addressed:
-        {chr(10).join(issue_descriptions)}
+        {issue_descriptions}
         
-        Original story:
-        {text}
+        Original image prompt:
+        {prompt}
+        """
+        
+        return self._ai_rewrite(_IMAGE_FILTER_SYSTEM_PROMPT, user_prompt, prompt)
+    
+    def _ai_rewrite(self, system_prompt, user_prompt, text):
+        """
+        Send a rewrite request to the chat model, caching the result.
+        
+        Args:
+            system_prompt (str): Instructions for the kind of text being rewritten
+            user_prompt (str): The request with the issues and the text
+            text (str): The text being rewritten, returned if the request fails
+            
+        Returns:
+            str: Rewritten text
         """
+        key = make_key(self.model, system_prompt, user_prompt)
+        cached = self._filter_cache.get(key)
+        if cached is not None:
+            logging.debug("Using cached AI content filter result")
+            return cached
         
         try:
             response = self.client.chat.completions.create(
@@ -247,7 +476,8 @@ class ContentFilter:
             )
             
             filtered_text = response.choices[0].message.content.strip()
-            logging.info("Successfully filtered story content using AI")
+            self._filter_cache.set(key, filtered_text, expire=CACHE_EXPIRE)
+            logging.info("Successfully filtered content using AI")
             return filtered_text
             
         except Exception as e:
@@ -282,7 +512,7 @@ if __name__ == "__main__":
     print(f"Appropriate: {check_result['is_appropriate']}")
     print("Issues found:")
     for issue in check_result["pattern_issues"]:
-        print(f"- '{issue['word']}' in context: \"{issue['context']}\"")
+        print(f"- '{issue.word}' in context: \"{issue.context}\"")
     
     filtered_story = filter.filter_story_content(test_story)
     print("\nFiltered Story:")
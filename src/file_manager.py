@@ -4,14 +4,20 @@ Module for handling file operations, including creating directories and saving c
 import os
 import re
 import datetime
-import sys
 import logging
 from pathlib import Path
 
-# Import configuration
-sys.path.append(".")
 from config.config import OUTPUT_DIR
 
+# Patterns used to turn story titles into file and folder names
+_RE_MD_TITLE = re.compile(r'^#\s+')
+_RE_INVALID = re.compile(r'[\\/*?:"<>|]')
+_RE_SPACE = re.compile(r'[\s\-]+')
+_RE_EXTRACT = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+# Blank lines separating markdown paragraphs
+_RE_PARAGRAPHS = re.compile(r'\n\n+')
+
 
 class FileManager:
     def __init__(self, custom_output_dir=None):
@@ -22,11 +28,13 @@ class FileManager:
             custom_output_dir (str, optional): Custom output directory. If None, uses default.
         """
         self.output_dir = custom_output_dir if custom_output_dir else OUTPUT_DIR
+        self._parent_verified = False
         self.ensure_output_dir_exists()
     
     def ensure_output_dir_exists(self):
         """Ensure the output directory exists."""
         os.makedirs(self.output_dir, exist_ok=True)
+        self._parent_verified = True
         logging.debug(f"Ensured output directory exists: {self.output_dir}")
     
     def create_story_folder(self, story_title):
@@ -51,8 +59,15 @@ class FileManager:
         # Create the full path
         folder_path = os.path.join(self.output_dir, folder_name)
         
-        # Create the folder
-        os.makedirs(folder_path, exist_ok=True)
+        # Create the folder; the output directory only needs checking once
+        if not self._parent_verified:
+            self.ensure_output_dir_exists()
+        try:
+            Path(folder_path).mkdir(exist_ok=True)
+        except FileNotFoundError:
+            # The output directory was removed since it was last checked
+            self.ensure_output_dir_exists()
+            Path(folder_path).mkdir(exist_ok=True)
         
         logging.info(f"Created story folder: {folder_path}")
         return folder_path
@@ -76,9 +91,12 @@ class FileManager:
         filename = f"{clean_title}.md"
         file_path = os.path.join(folder_path, filename)
         
-        # Save the story
-        with open(file_path, 'w', encoding='utf-8') as f:
+        # Save the story to a temporary sibling first and rename it into place, so
+        # readers never see a partially written file
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(story_text)
+        os.replace(tmp_path, file_path)
         
         logging.info(f"Saved story markdown to: {file_path}")
         return file_path
@@ -95,39 +113,42 @@ class FileManager:
             str: Path to the updated markdown file
         """
         # Read the original markdown
-        with open(markdown_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = Path(markdown_path).read_text(encoding='utf-8')
         
-        # Find appropriate places to insert images
-        paragraphs = re.split(r'\n\n+', content)
+        # Find appropriate places to insert images: the offset where each
+        # paragraph after the first one starts
+        paragraph_starts = [match.end() for match in _RE_PARAGRAPHS.finditer(content)]
+        num_paragraphs = len(paragraph_starts) + 1
         
         # Calculate how many paragraphs per image (approximately)
-        if len(paragraphs) <= 1 or not image_paths:
+        if num_paragraphs <= 1 or not image_paths:
             # Not enough paragraphs or no images
             logging.warning("Not enough paragraphs or no images to insert")
             return markdown_path
         
         # Determine insertion points (after intro, before conclusion, and in between)
         num_images = len(image_paths)
-        step = max(1, (len(paragraphs) - 2) // (num_images))
+        step = max(1, (num_paragraphs - 2) // (num_images))
         
-        # Start after the title (index 1) and leave the last paragraph
-        insertion_points = list(range(1, len(paragraphs) - 1, step))[:num_images]
+        # Start after the title (index 1) and leave the last paragraph;
+        # each image goes right before the paragraph at that index
+        insertion_points = list(range(1, num_paragraphs - 1, step))[:num_images]
         
-        # Insert images at the determined points
+        # Build the output by slicing the original content around the insertion offsets
+        parts = []
+        previous = 0
         for i, point in enumerate(insertion_points):
-            if i < len(image_paths):
-                # Get relative path for the image
-                image_filename = os.path.basename(image_paths[i])
-                image_markdown = f"\n\n![Image {i+1}]({image_filename})\n\n"
-                paragraphs.insert(point + i, image_markdown)
-        
-        # Join the paragraphs back together
-        updated_content = '\n\n'.join(paragraphs)
-        
-        # Save the updated markdown
-        with open(markdown_path, 'w', encoding='utf-8') as f:
-            f.write(updated_content)
+            offset = paragraph_starts[point - 1]
+            image_filename = os.path.basename(image_paths[i])
+            parts.append(content[previous:offset])
+            parts.append(f"\n\n![Image {i+1}]({image_filename})\n\n\n\n")
+            previous = offset
+        parts.append(content[previous:])
+        updated_content = "".join(parts)
+        
+        # Save the updated markdown only if something changed
+        if updated_content != content:
+            Path(markdown_path).write_text(updated_content, encoding='utf-8')
         
         logging.info(f"Updated markdown with {len(image_paths)} images")
         return markdown_path
@@ -143,13 +164,13 @@ class FileManager:
             str: Cleaned title
         """
         # Remove markdown formatting if present
-        title = re.sub(r'^#\s+', '', title)
+        title = _RE_MD_TITLE.sub('', title)
         
         # Replace invalid filename characters
-        title = re.sub(r'[\\/*?:"<>|]', '', title)
+        title = _RE_INVALID.sub('', title)
         
         # Replace spaces and other characters with underscores
-        title = re.sub(r'[\s\-]+', '_', title)
+        title = _RE_SPACE.sub('_', title)
         
         # Limit length
         title = title[:50]
@@ -175,12 +196,12 @@ class FileManager:
             str: The extracted title
         """
         # Look for a markdown title
-        title_match = re.search(r'^#\s+(.+)$', markdown_text, re.MULTILINE)
+        title_match = _RE_EXTRACT.search(markdown_text)
         if title_match:
             return title_match.group(1).strip()
         
         # If no markdown title, use the first line
-        first_line = markdown_text.split('\n')[0].strip()
+        first_line = markdown_text.partition('\n')[0].strip()
         if first_line:
             return first_line
         
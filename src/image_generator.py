@@ -1,39 +1,53 @@
 """
 Module for generating images based on prompts using OpenAI's DALL-E API.
 """
-import time
 import os
-import sys
+import shutil
 import requests
-from io import BytesIO
-from PIL import Image
-from openai import OpenAI
-from openai import APIError, RateLimitError, APIConnectionError
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from openai import RateLimitError, APIConnectionError, InternalServerError
 import logging
+from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
 
-# Import configuration
-sys.path.append(".")
 from config.config import (
-    OPENAI_API_KEY, IMAGE_MODEL, IMAGE_SIZE, 
+    IMAGE_MODEL, IMAGE_SIZE, 
     IMAGE_QUALITY, IMAGE_STYLE, OUTPUT_DIR
 )
+from src.openai_client import get_client
+from src.prompt_utils import apply_safety_wrapper
+
+
+def _print_retry(retry_state):
+    """Report a failed image request or download before tenacity sleeps."""
+    print(
+        f"Error: {str(retry_state.outcome.exception())}. "
+        f"Retrying in {retry_state.next_action.sleep:.1f} seconds..."
+    )
 
 
 class ImageGenerator:
-    def __init__(self, model=None):
+    def __init__(self, model=None, max_parallel=5):
         """
         Initialize the image generator with API client and parameters.
         
         Args:
             model (str, optional): Custom model to use. If None, uses default.
+            max_parallel (int, optional): Maximum number of images generated at once
         """
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = get_client()
         self.model = model if model else IMAGE_MODEL
         self.size = IMAGE_SIZE
         self.quality = IMAGE_QUALITY
         self.style = IMAGE_STYLE
-        self.max_retries = 3
-        self.retry_delay = 5  # seconds
+        self.max_parallel = max_parallel
+        self.download_timeout = 30  # seconds
+        
+        # Shared session so image downloads reuse connections across threads
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_parallel, pool_maxsize=max_parallel)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         
         logging.debug(f"Initialized ImageGenerator with model={self.model}")
 
@@ -50,24 +64,37 @@ class ImageGenerator:
             list: Paths to the generated images
         """
         image_paths = []
+        if not image_prompts:
+            return image_paths
         
-        for i, prompt in enumerate(image_prompts):
-            try:
-                image_path = self._generate_single_image(prompt, story_folder, i+1)
-                if image_path:
-                    image_paths.append(image_path)
-                    print(f"Generated image {i+1}/{len(image_prompts)}")
-                else:
-                    print(f"Failed to generate image {i+1}/{len(image_prompts)}")
-            except Exception as e:
-                print(f"Error generating image {i+1}: {str(e)}")
+        # Each DALL-E call is network-bound and independent, so run them concurrently
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_parallel, len(image_prompts)))) as executor:
+            futures = [
+                executor.submit(self.generate_single_image, prompt, story_folder, i + 1)
+                for i, prompt in enumerate(image_prompts)
+            ]
+            
+            # Gather in submission order so image numbering matches the story order
+            for i, future in enumerate(futures):
+                try:
+                    image_path = future.result()
+                    if image_path:
+                        image_paths.append(image_path)
+                        print(f"Generated image {i+1}/{len(image_prompts)}")
+                    else:
+                        print(f"Failed to generate image {i+1}/{len(image_prompts)}")
+                except Exception as e:
+                    print(f"Error generating image {i+1}: {str(e)}")
         
         return image_paths
     
-    def _generate_single_image(self, prompt, story_folder, image_number):
+    def generate_single_image(self, prompt, story_folder, image_number):
         """
         Generate a single image and save it to disk.
         
+        Safe to call concurrently from several threads for the same story folder,
+        as each image is written to its own numbered file.
+        
         Args:
             prompt (str): The image prompt
             story_folder (str): Path to the story folder
@@ -77,83 +104,85 @@ class ImageGenerator:
             str: Path to the saved image, or None if generation failed
         """
         # Ensure the prompt is child-appropriate
-        safe_prompt = self._ensure_safe_prompt(prompt)
-        
-        # Attempt to generate the image with retries
-        for attempt in range(self.max_retries):
-            try:
-                print(f"Generating image {image_number} (attempt {attempt + 1})...")
-                
-                response = self.client.images.generate(
-                    model=self.model,
-                    prompt=safe_prompt,
-                    size=self.size,
-                    quality=self.quality,
-                    style=self.style,
-                    n=1
-                )
-                
-                # Get the image URL
-                image_url = response.data[0].url
-                
-                # Download and save the image
-                image_filename = f"image_{image_number:02d}.png"
-                image_path = os.path.join(story_folder, image_filename)
-                
-                # Download the image
-                image_data = requests.get(image_url).content
-                img = Image.open(BytesIO(image_data))
-                
-                # Save the image
-                img.save(image_path)
-                
-                return image_path
-                
-            except RateLimitError:
-                print(f"Rate limit exceeded. Waiting {self.retry_delay} seconds before retrying...")
-                time.sleep(self.retry_delay)
-                self.retry_delay *= 2  # Exponential backoff
-                
-            except (APIError, APIConnectionError) as e:
-                print(f"API error: {str(e)}. Retrying in {self.retry_delay} seconds...")
-                time.sleep(self.retry_delay)
-                
-            except Exception as e:
-                print(f"Unexpected error: {str(e)}")
-                if attempt == self.max_retries - 1:
-                    return None
-                time.sleep(self.retry_delay)
+        safe_prompt = apply_safety_wrapper(prompt)
         
-        return None
+        try:
+            print(f"Generating image {image_number}...")
+            response = self._call_images_generate(safe_prompt)
+            
+            # Get the image URL
+            image_url = response.data[0].url
+            
+            # Download and save the image
+            image_filename = f"image_{image_number:02d}.png"
+            image_path = os.path.join(story_folder, image_filename)
+            
+            self._download_image(image_url, image_path)
+            
+            return image_path
+            
+        except Exception as e:
+            print(f"Failed to generate image {image_number}: {str(e)}")
+            return None
     
-    def _ensure_safe_prompt(self, prompt):
+    @retry(
+        wait=wait_random_exponential(min=2, max=60),
+        stop=stop_after_attempt(5),
+        # Only transient errors; 4xx errors such as content policy rejections never succeed on retry
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        before_sleep=_print_retry,
+        reraise=True
+    )
+    def _call_images_generate(self, prompt):
         """
-        Ensure the prompt is child-appropriate by adding safety instructions.
+        Request a single image from the API, retrying transient errors with jittered backoff.
         
         Args:
-            prompt (str): The original image prompt
+            prompt (str): The safety-wrapped image prompt
             
         Returns:
-            str: Enhanced prompt with safety instructions
+            ImagesResponse: The API response
         """
-        # Add safety instructions to the prompt
-        safety_instructions = (
-            "Create a child-friendly, G-rated illustration suitable for young children. "
-            "Use bright, cheerful colors and a non-threatening style. "
-            "Ensure all content is age-appropriate for children ages 4-10. "
+        return self.client.images.generate(
+            model=self.model,
+            prompt=prompt,
+            size=self.size,
+            quality=self.quality,
+            style=self.style,
+            n=1
         )
+
+    @retry(
+        wait=wait_random_exponential(min=1, max=10),
+        stop=stop_after_attempt(3),
+        # Errors raised while copying from r.raw come straight from urllib3
+        retry=retry_if_exception_type((requests.RequestException, Urllib3HTTPError)),
+        before_sleep=_print_retry,
+        reraise=True
+    )
+    def _download_image(self, image_url, image_path):
+        """
+        Stream a generated image to disk, retrying failed downloads.
         
-        # Check if the prompt already has style instructions
-        if "style:" in prompt.lower() or "style=" in prompt.lower():
-            # Insert safety instructions before style instructions
-            parts = prompt.split("Style:", 1) if "Style:" in prompt else prompt.split("style:", 1)
-            enhanced_prompt = parts[0] + safety_instructions + "Style:" + parts[1]
-        else:
-            # Add safety instructions and style guidance
-            enhanced_prompt = safety_instructions + prompt + " Style: children's book illustration, colorful, whimsical."
+        The bytes go to a temporary file that only replaces image_path once the
+        download completes, so a failed attempt never leaves a truncated PNG.
         
-        return enhanced_prompt
-
+        Args:
+            image_url (str): URL of the generated image
+            image_path (str): Path where the image should be saved
+        """
+        tmp_path = image_path + ".tmp"
+        try:
+            with self.session.get(image_url, stream=True, timeout=self.download_timeout) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(r.raw, f, 65536)
+            os.replace(tmp_path, image_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
 if __name__ == "__main__":
     # Test the image generator
@@ -2,20 +2,59 @@
 Module for extracting key scenes from a story and creating image prompts.
 """
 import re
-import sys
-from openai import OpenAI
+import json
+import asyncio
+from collections import Counter
+from openai import AsyncOpenAI
 
-# Import configuration
-sys.path.append(".")
-from config.config import OPENAI_API_KEY, STORY_MODEL, IMAGES_PER_STORY
+from config.config import OPENAI_API_KEY, STORY_MODEL, IMAGES_PER_STORY, SCENE_STORY_MAX_CHARS, CACHE_EXPIRE
+from src.llm_cache import LLMCache, make_key
+from src.openai_client import get_client
+from src.utils import ensure_story_title
 
+# Compact scene extraction prompts; the output format is enforced by the JSON response format
+_SYS_PROMPT_TMPL = """Identify exactly {n} key scenes in a children's story to illustrate.
+Rules:
+- visually interesting, advances the plot
+- main characters and important story elements
+- spread evenly over beginning, middle and end
+- detailed prompt for a text-to-image model: characters, setting, action, mood
+- 1-3 sentences each
+- child-appropriate
+Return JSON: {{"prompts": [{n} strings]}}"""
+
+# Patterns for parsing stories and model responses, compiled once
+_TITLE_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+_CAP_WORD_RE = re.compile(r'\b[A-Z][a-z]+\b')
+
+# Capitalized words that are never character names
+_STOPWORDS = frozenset({"The", "This", "That", "There", "They", "Then"})
+
+# Style guidance appended to every image prompt
+_STYLE_SUFFIX = " Style: colorful children's book illustration, child-friendly, whimsical, detailed, vibrant colors, digital art."
+
+# Paragraph that tells extract_scenes_incremental to give up without sending a request
+ABORT_EXTRACTION = object()
+
+_USER_PROMPT_TMPL = """Title: {title}
+Story:
+{story}
+Return JSON with {n} image prompts."""
 
 class ImagePromptCreator:
     def __init__(self):
         """Initialize the image prompt creator."""
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = get_client()
+        self._aclient = None
+        self._aclient_loop = None
+        self._scene_cache = LLMCache("scene_extraction")
         self.model = STORY_MODEL
         self.num_images = IMAGES_PER_STORY
+        
+        # The system prompt only depends on the number of images, so it is built once
+        # and sent byte-identical as the first message, letting OpenAI's prompt cache hit
+        self._system_prompt = _SYS_PROMPT_TMPL.format(n=self.num_images)
+        self._system_prompt_images = self.num_images
     
     def extract_scenes(self, story_text, num_images=None):
         """
@@ -27,132 +66,298 @@ class ImagePromptCreator:
         Returns:
             list: List of image prompts for key scenes
         """
+        title, request, key, cached = self._prepare_scene_request(story_text, num_images)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = self.client.chat.completions.create(**request)
+            return self._store_scene_response(key, response)
+            
+        except Exception as e:
+            print(f"Error extracting scenes: {str(e)}")
+            return self._create_generic_prompts(title, story_text)
+    
+    def extract_scenes_batch(self, stories, num_images=None, max_concurrency=8):
+        """
+        Extract key scenes from several stories with concurrent requests.
+        
+        Args:
+            stories (list): The story texts
+            num_images (int, optional): Number of scenes to extract per story
+            max_concurrency (int): Maximum number of requests in flight at once
+            
+        Returns:
+            list: One list of image prompts per story, in the same order
+        """
         if num_images is not None:
             self.num_images = num_images
+        
+        return asyncio.run(self._extract_scenes_batch_async(stories, max_concurrency))
+    
+    async def _extract_scenes_batch_async(self, stories, max_concurrency):
+        """
+        Run the scene extraction requests for extract_scenes_batch.
+        
+        Args:
+            stories (list): The story texts
+            max_concurrency (int): Maximum number of requests in flight at once
+            
+        Returns:
+            list: One list of image prompts per story, in the same order
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def extract(story_text):
+            async with semaphore:
+                return await self.extract_scenes_async(story_text)
+        
+        try:
+            return await asyncio.gather(*(extract(story_text) for story_text in stories))
+        finally:
+            # The event loop of asyncio.run() ends with the batch, so close its client
+            await self.aclose()
+    
+    async def extract_scenes_async(self, story_text, num_images=None):
+        """
+        Extract key scenes from the story without blocking the event loop.
+        
+        Callers running their own event loop can overlap several extractions with
+        asyncio.gather(), or run them alongside other requests.
+        
+        Args:
+            story_text (str): The generated story text
+            num_images (int, optional): Number of scenes to extract
             
+        Returns:
+            list: List of image prompts for key scenes
+        """
+        title, request, key, cached = self._prepare_scene_request(story_text, num_images)
+        if cached is not None:
+            return cached
+        
+        try:
+            response = await self._get_async_client().chat.completions.create(**request)
+            return self._store_scene_response(key, response)
+            
+        except Exception as e:
+            print(f"Error extracting scenes: {str(e)}")
+            return self._create_generic_prompts(title, story_text)
+    
+    def _prepare_scene_request(self, story_text, num_images=None):
+        """
+        Build a scene extraction request and look it up in the scene cache.
+        
+        Shared by extract_scenes and extract_scenes_async, so both send the same
+        request for the same story.
+        
+        Args:
+            story_text (str): The generated story text
+            num_images (int, optional): Number of scenes to extract
+            
+        Returns:
+            tuple: (title, keyword arguments for chat.completions.create, cache key,
+                cached image prompts or None)
+        """
+        if num_images is not None:
+            self.num_images = num_images
+        
         # Extract title for context
         title = self._extract_title(story_text)
+        messages = self._build_messages(title, story_text)
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "response_format": {"type": "json_object"}
+        }
         
-        # Create a system prompt for scene extraction
-        system_prompt = f"""
-        You are an expert at identifying key visual scenes from children's stories.
-        Your task is to identify exactly {self.num_images} key scenes from the provided story 
-        that would make good illustrations for a children's book.
-        
-        For each scene:
-        1. Choose visually interesting moments that advance the story
-        2. Focus on the main characters and important story elements
-        3. Distribute scenes evenly throughout the story (beginning, middle, end)
-        4. Create detailed, specific image prompts that a text-to-image AI can use
-        5. Make each prompt child-appropriate and visually appealing
-        6. Include specific details about characters, setting, actions, and mood
-        7. Format each prompt to be 1-3 sentences long
+        # Re-processing the same story (retries, re-runs) is answered from the cache
+        key = self._scene_cache_key(messages)
+        return title, request, key, self._scene_cache.get(key)
+    
+    def _store_scene_response(self, key, response):
+        """
+        Parse a scene extraction response and cache the image prompts.
         
-        Return ONLY a JSON array of {self.num_images} image prompts, with no additional text.
-        Each prompt should be a string in the array.
+        Args:
+            key (str): Cache key from _prepare_scene_request
+            response (ChatCompletion): The API response
+            
+        Returns:
+            list: List of image prompts for key scenes
+        """
+        image_prompts = self._parse_scene_response(response.choices[0].message.content)
+        self._scene_cache.set(key, image_prompts, expire=CACHE_EXPIRE)
+        return image_prompts
+    
+    def _get_async_client(self):
         """
+        Get the async client for the running event loop.
         
-        # User prompt with the story
-        user_prompt = f"""
-        Story Title: {title}
+        The client is cached per event loop, as its connection pool cannot be
+        shared between the loops started by separate asyncio.run() calls.
         
-        Story Text:
-        {story_text}
+        Returns:
+            AsyncOpenAI: The async client
+        """
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+            self._aclient_loop = loop
+        return self._aclient
+    
+    async def aclose(self):
+        """Close the async client before its event loop ends."""
+        if self._aclient is not None:
+            aclient, self._aclient, self._aclient_loop = self._aclient, None, None
+            await aclient.close()
+    
+    def _build_messages(self, title, story_text):
+        """
+        Build the chat messages for a scene extraction request.
         
-        Identify exactly {self.num_images} key scenes from this story that would make good illustrations.
-        Return them as a JSON array of strings, with each string being a detailed image prompt.
+        Args:
+            title (str): The story title
+            story_text (str): The story text
+            
+        Returns:
+            list: System and user messages
         """
+        if self._system_prompt_images != self.num_images:
+            # The number of images changed since the system prompt was built
+            self._system_prompt = _SYS_PROMPT_TMPL.format(n=self.num_images)
+            self._system_prompt_images = self.num_images
         
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
+        return [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": _USER_PROMPT_TMPL.format(title=title, story=self._compact_story(story_text), n=self.num_images)}
+        ]
+    
+    def _compact_story(self, story_text, max_chars=SCENE_STORY_MAX_CHARS):
+        """
+        Shorten a long story to excerpts that still cover all of its scenes.
+        
+        Stories up to max_chars are returned unchanged. Longer stories keep their
+        first and last paragraphs plus one paragraph from each of num_images evenly
+        sized parts of the story, each cut to an equal share of max_chars.
+        
+        Args:
+            story_text (str): The story text
+            max_chars (int): Maximum length of the text sent to the model
             
-            # Extract the JSON response
-            content = response.choices[0].message.content.strip()
+        Returns:
+            str: The story text or its excerpts
+        """
+        if len(story_text) <= max_chars:
+            return story_text
+        
+        paragraphs = [paragraph.strip() for paragraph in story_text.split("\n\n") if paragraph.strip()]
+        count = len(paragraphs)
+        if count <= 2:
+            return story_text[:max_chars]
+        
+        picks = {0, count - 1}
+        picks.update(int((i + 0.5) * count / self.num_images) for i in range(self.num_images))
+        budget = max_chars // len(picks)
+        
+        excerpts = []
+        previous = -1
+        for index in sorted(picks):
+            if index != previous + 1:
+                excerpts.append("[...]")
+            excerpts.append(paragraphs[index][:budget])
+            previous = index
+        
+        return f"(Excerpts from a story of {count} paragraphs)\n\n" + "\n\n".join(excerpts)
+    
+    def _scene_cache_key(self, messages):
+        """
+        Build the scene cache key for a scene extraction request.
+        
+        The key covers the model and the full messages, so it changes with the
+        story text, the number of images and the prompts themselves.
+        
+        Args:
+            messages (list): Messages from _build_messages
             
-            # Clean up the response to extract just the array
-            import json
-            try:
-                # Parse the JSON response
-                parsed_response = json.loads(content)
-                
-                # Extract the array of prompts (handle different possible formats)
-                if isinstance(parsed_response, list):
-                    image_prompts = parsed_response
-                elif "prompts" in parsed_response:
-                    image_prompts = parsed_response["prompts"]
-                elif "scenes" in parsed_response:
-                    image_prompts = parsed_response["scenes"]
-                else:
-                    # Try to find any array in the response
-                    for key, value in parsed_response.items():
-                        if isinstance(value, list):
-                            image_prompts = value
-                            break
-                    else:
-                        # If no array found, use the first N items if it's a dict
-                        image_prompts = list(parsed_response.values())[:self.num_images]
-                
-                # Ensure we have the right number of prompts
-                image_prompts = image_prompts[:self.num_images]
-                
-                # Add child-friendly instruction to each prompt
-                enhanced_prompts = []
-                for prompt in image_prompts:
-                    # Ensure prompt is a string
-                    if not isinstance(prompt, str):
-                        prompt = str(prompt)
-                    
-                    # Add style instructions for child-friendly illustrations
-                    enhanced_prompt = f"{prompt} Style: colorful children's book illustration, child-friendly, whimsical, detailed, vibrant colors, digital art."
-                    enhanced_prompts.append(enhanced_prompt)
-                
-                return enhanced_prompts
-                
-            except json.JSONDecodeError:
-                # Fallback: try to extract prompts using regex if JSON parsing fails
-                print("Warning: Could not parse JSON response. Attempting to extract prompts manually.")
-                pattern = r'"([^"]+)"'
-                matches = re.findall(pattern, content)
-                
-                if matches and len(matches) >= self.num_images:
-                    return [f"{match} Style: colorful children's book illustration, child-friendly, whimsical." 
-                            for match in matches[:self.num_images]]
-                else:
-                    # Last resort: split by numbered list if available
-                    lines = content.split("\n")
-                    prompts = []
-                    for line in lines:
-                        if re.match(r'^\d+[\.\)]\s', line):  # Matches numbered lists like "1. " or "1) "
-                            prompt_text = re.sub(r'^\d+[\.\)]\s', '', line).strip()
-                            if prompt_text:
-                                prompts.append(f"{prompt_text} Style: colorful children's book illustration, child-friendly.")
-                    
-                    if prompts and len(prompts) >= self.num_images:
-                        return prompts[:self.num_images]
+        Returns:
+            str: Cache key
+        """
+        return make_key(self.model, *(message["content"] for message in messages))
+    
+    def _parse_scene_response(self, content):
+        """
+        Turn the model's scene extraction response into image prompts.
+        
+        The request asks for a JSON object, so invalid JSON is left to raise and
+        the caller falls back to generic prompts.
+        
+        Args:
+            content (str): The raw response content
             
-            # If all parsing attempts fail, create generic prompts
-            return self._create_generic_prompts(title, story_text)
+        Returns:
+            list: List of image prompts for key scenes
+        """
+        parsed_response = json.loads(content)
+        
+        # Extract the array of prompts (handle different possible formats)
+        if isinstance(parsed_response, list):
+            image_prompts = parsed_response
+        elif "prompts" in parsed_response:
+            image_prompts = parsed_response["prompts"]
+        elif "scenes" in parsed_response:
+            image_prompts = parsed_response["scenes"]
+        else:
+            # Try to find any array in the response
+            for key, value in parsed_response.items():
+                if isinstance(value, list):
+                    image_prompts = value
+                    break
+            else:
+                # If no array found, use the first N items if it's a dict
+                image_prompts = list(parsed_response.values())[:self.num_images]
+        
+        # Ensure we have the right number of prompts
+        image_prompts = image_prompts[:self.num_images]
+        
+        # Add style instructions for child-friendly illustrations to each prompt
+        return [(prompt if isinstance(prompt, str) else str(prompt)) + _STYLE_SUFFIX for prompt in image_prompts]
+    
+    def extract_scenes_incremental(self, paragraphs, num_images=None):
+        """
+        Extract key scenes from a story that is delivered paragraph by paragraph.
+        
+        Paragraphs are consumed as they are produced (for example from a queue fed
+        by a streaming story generator), so the extraction request is issued as soon
+        as the last paragraph arrives. The story gets the same title the story
+        generator adds, so the request matches the one for the finished story.
+        If ABORT_EXTRACTION arrives instead, no request is sent.
+        
+        Args:
+            paragraphs (iterable): Story paragraphs in reading order
+            num_images (int, optional): Number of scenes to extract
             
-        except Exception as e:
-            print(f"Error extracting scenes: {str(e)}")
-            return self._create_generic_prompts(title, story_text)
+        Returns:
+            list: List of image prompts for key scenes, or None if aborted
+        """
+        collected = []
+        for paragraph in paragraphs:
+            if paragraph is ABORT_EXTRACTION:
+                return None
+            collected.append(paragraph)
+        
+        story_text = ensure_story_title("\n\n".join(collected).strip())
+        return self.extract_scenes(story_text, num_images)
     
     def _extract_title(self, story_text):
         """Extract the title from the story text."""
         # Look for a markdown title
-        title_match = re.search(r'^#\s+(.+)$', story_text, re.MULTILINE)
+        title_match = _TITLE_RE.search(story_text)
         if title_match:
             return title_match.group(1).strip()
         
         # If no markdown title, use the first line
-        first_line = story_text.split('\n')[0].strip()
+        first_line = story_text.partition('\n')[0].strip()
         if first_line:
             return first_line
         
@@ -161,31 +366,31 @@ class ImagePromptCreator:
     
     def _create_generic_prompts(self, title, story_text):
         """Create generic image prompts based on the story title and text."""
-        # Extract character names (simple approach)
-        words = re.findall(r'\b[A-Z][a-z]+\b', story_text)
-        potential_characters = [word for word in words if len(word) > 3 and word not in ["The", "This", "That", "There", "They", "Then"]]
+        # Extract character names (simple approach) and count them in a single pass
+        character_counts = Counter(
+            word for word in (match.group(0) for match in _CAP_WORD_RE.finditer(story_text))
+            if len(word) > 3 and word not in _STOPWORDS
+        )
         
         # Get most common potential character names
-        from collections import Counter
-        character_counts = Counter(potential_characters)
         main_characters = [char for char, count in character_counts.most_common(3) if count > 1]
         
         # Create generic prompts
         prompts = []
         
         # Title/introduction scene
-        prompts.append(f"The main scene from the children's story '{title}'. Colorful illustration, child-friendly style, whimsical setting.")
+        prompts.append(f"The main scene from the children's story '{title}'." + _STYLE_SUFFIX)
         
         # Character-based scenes
         for character in main_characters[:2]:
-            prompts.append(f"{character} from the story '{title}', engaging in an adventure. Colorful children's book illustration style, child-friendly, detailed.")
+            prompts.append(f"{character} from the story '{title}', engaging in an adventure." + _STYLE_SUFFIX)
         
         # Conclusion scene
-        prompts.append(f"The happy ending scene from the children's story '{title}'. Colorful, warm, and joyful illustration in a child-friendly style.")
+        prompts.append(f"The happy ending scene from the children's story '{title}', warm and joyful." + _STYLE_SUFFIX)
         
         # Fill remaining slots if needed
         while len(prompts) < self.num_images:
-            prompts.append(f"An exciting scene from the children's story '{title}'. Vibrant colors, child-friendly illustration style, whimsical and engaging.")
+            prompts.append(f"An exciting scene from the children's story '{title}', engaging and full of fun." + _STYLE_SUFFIX)
         
         return prompts[:self.num_images]
 
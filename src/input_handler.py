@@ -4,6 +4,12 @@ Module for handling and validating user input for story generation.
 import re
 import sys
 
+try:
+    import ahocorasick
+except ImportError:
+    # Optional dependency (pyahocorasick); fall back to the regex scan
+    ahocorasick = None
+
 
 class InputHandler:
     def __init__(self):
@@ -13,6 +19,21 @@ class InputHandler:
             "violent", "kill", "murder", "blood", "gore", "death", 
             "explicit", "sexual", "adult", "nsfw"
         ]
+        
+        # One case-insensitive alternation finds any forbidden word in a single scan
+        self._forbidden_re = re.compile(
+            r'\b(' + '|'.join(map(re.escape, self.forbidden_words)) + r')\b',
+            re.IGNORECASE
+        )
+        
+        # With pyahocorasick installed, an automaton scans for all words at once
+        # regardless of how many forbidden words there are
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for word in self.forbidden_words:
+                self._automaton.add_word(word.lower(), word.lower())
+            self._automaton.make_automaton()
 
     def get_story_prompt(self):
         """
@@ -53,29 +74,66 @@ class InputHandler:
         Returns:
             dict: Validation result with 'valid' boolean and 'message' string
         """
-        # Check input length
-        if len(user_input) < self.min_length:
+        # Check input length first, before any scanning of the text
+        length = len(user_input)
+        if length < self.min_length:
             return {
                 "valid": False,
                 "message": f"Input is too short. Minimum {self.min_length} characters required."
             }
         
-        if len(user_input) > self.max_length:
+        if length > self.max_length:
             return {
                 "valid": False,
                 "message": f"Input is too long. Maximum {self.max_length} characters allowed."
             }
         
         # Check for forbidden words
-        for word in self.forbidden_words:
-            if re.search(r'\b' + re.escape(word) + r'\b', user_input.lower()):
-                return {
-                    "valid": False,
-                    "message": f"Input contains inappropriate content ('{word}'). Please provide a child-friendly story idea."
-                }
+        word = self._find_forbidden_word(user_input)
+        if word:
+            return {
+                "valid": False,
+                "message": f"Input contains inappropriate content ('{word}'). Please provide a child-friendly story idea."
+            }
         
         # Input is valid
         return {"valid": True, "message": "Input is valid"}
+    
+    def _find_forbidden_word(self, text):
+        """
+        Find the forbidden word that appears as a whole word in the text.
+        
+        The text is scanned once for all words. When several appear, the one that
+        comes first in forbidden_words is reported, as with a check per word.
+        
+        Args:
+            text (str): The text to scan
+            
+        Returns:
+            str: The forbidden word found (lowercase), or None
+        """
+        found = set(self._iter_forbidden_words(text))
+        return next((word.lower() for word in self.forbidden_words if word.lower() in found), None)
+    
+    def _iter_forbidden_words(self, text):
+        """Yield every whole-word occurrence of a forbidden word in the text, lowercased."""
+        if self._automaton is None:
+            for match in self._forbidden_re.finditer(text):
+                yield match.group(1).lower()
+            return
+        
+        lowered = text.lower()
+        for end, word in self._automaton.iter(lowered):
+            start = end - len(word) + 1
+            # Only accept whole-word matches, like the regex's \b anchors
+            if (start == 0 or not _is_word_char(lowered[start - 1])) and \
+                    (end + 1 == len(lowered) or not _is_word_char(lowered[end + 1])):
+                yield word
+
+
+def _is_word_char(char):
+    """Check whether a character counts as part of a word, as for regex word boundaries."""
+    return char.isalnum() or char == "_"
 
 
 if __name__ == "__main__":
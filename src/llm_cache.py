@@ -0,0 +1,95 @@
+"""
+Module for caching LLM responses on disk between runs.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+
+from config.config import CACHE_DIR
+
+
+def make_key(*parts):
+    """
+    Build a cache key from the parts that determine an LLM response.
+
+    Args:
+        *parts (str): Model name, system prompt, user text, ...
+
+    Returns:
+        str: Hex SHA-256 digest of the parts
+    """
+    # Join with NUL so ("0.7", "1500") and ("0.71", "500") get different keys
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, namespace, cache_dir=None):
+        """
+        Initialize a cache that stores one JSON file per key.
+
+        Args:
+            namespace (str): Sub-directory used to keep different callers apart
+            cache_dir (str, optional): Base cache directory. If None, uses CACHE_DIR from the config.
+        """
+        self.directory = os.path.join(cache_dir or CACHE_DIR, namespace)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, default=None):
+        """
+        Get a cached value.
+
+        Args:
+            key (str): Cache key
+            default: Value returned on a miss or an expired entry
+
+        Returns:
+            The cached value, or default
+        """
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return default
+
+        expires = entry.get("expires")
+        if expires is not None and expires < time.time():
+            # Remove the stale entry so the cache does not grow without limit
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return default
+        return entry.get("value", default)
+
+    def set(self, key, value, expire=None):
+        """
+        Store a JSON-serializable value.
+
+        Args:
+            key (str): Cache key
+            value: Value to store
+            expire (float, optional): Seconds until the entry expires. If None, never expires.
+
+        Returns:
+            bool: True if the value was stored, False otherwise
+        """
+        entry = {"value": value, "expires": time.time() + expire if expire else None}
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"Could not write cache entry {key}: {str(e)}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
@@ -0,0 +1,40 @@
+"""
+Module providing the OpenAI client shared by all components.
+"""
+import threading
+import importlib.util
+
+import httpx
+from openai import OpenAI, DefaultHttpxClient
+
+from config.config import OPENAI_API_KEY
+
+# HTTP/2 needs the h2 package from requirements.txt; without it the client uses HTTP/1.1
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get the shared OpenAI client, creating it on first use.
+
+    All components use the same client, so they share one connection pool
+    and keep-alive connections instead of opening their own.
+
+    Returns:
+        OpenAI: The shared client
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    http_client=DefaultHttpxClient(
+                        http2=_HTTP2,
+                        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+                    )
+                )
+    return _client
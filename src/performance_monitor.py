@@ -1,32 +1,55 @@
 from collections import deque
 import time
+import asyncio
 import json
 import os
 import logging
 import psutil
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-import sys
-
-# Add project root to path for imports
-sys.path.append(str(Path(__file__).parent.parent))
 
 from config.config import OUTPUT_DIR
+from src.utils import write_json
+
+# Operation names for the phases of the story generation pipeline
+PHASE_INPUT_HANDLING = "Input Handling"
+PHASE_PROMPT_OPTIMIZATION = "Prompt Optimization"
+PHASE_STORY_GENERATION = "Story Generation"
+PHASE_CONTENT_FILTERING = "Content Filtering"
+PHASE_FILE_MANAGEMENT = "File Management"
+PHASE_IMAGE_PROMPT_CREATION = "Image Prompt Creation"
+PHASE_IMAGE_PROMPT_OPTIMIZATION = "Image Prompt Optimization"
+PHASE_IMAGE_PROMPT_FILTERING = "Image Prompt Filtering"
+PHASE_IMAGE_GENERATION = "Image Generation"
+PHASE_MARKDOWN_UPDATE = "Markdown Update"
 
 
 class PerformanceMonitor:
-    def __init__(self, max_history=100):
+    def __init__(self, max_history=100, usage_log_path=None):
         """
         Initialize the performance monitor.
         
         Args:
             max_history (int): Maximum number of operations to keep in history
+            usage_log_path (str, optional): NDJSON file that every resource sample is
+                appended to while monitoring. If None, samples are only kept in memory.
         """
         self.operation_history = deque(maxlen=max_history)
+        self._open_ops = {}  # operation name -> stack of (record, start_ns) still running
+        self._stats = {}  # operation name -> running count/total/min/max of durations
         self.monitoring = False
         self.monitor_thread = None
-        self.resource_usage = []
+        self._monitor_task = None
+        self.resource_usage = deque(maxlen=max_history * 10)
         self.sampling_interval = 1  # seconds
+        self.usage_log_path = usage_log_path
+        self._usage_fp = None
+        
+        # Reuse one Process handle; the first cpu_percent call only sets the baseline
+        self._proc = psutil.Process()
+        self._proc.cpu_percent(None)
     
     def start_operation(self, operation_name):
         """
@@ -36,13 +59,17 @@ class PerformanceMonitor:
             operation_name (str): Name of the operation
         """
         start_time = time.time()
-        self.operation_history.append({
+        record = {
             "operation": operation_name,
             "start_time": start_time,
             "end_time": None,
             "duration": None
-        })
-        logging.info(f"Started operation: {operation_name}")
+        }
+        self.operation_history.append(record)
+        # Durations come from the monotonic counter; the wall-clock times are only
+        # kept to record when the operation happened
+        self._open_ops.setdefault(operation_name, []).append((record, time.perf_counter_ns()))
+        logging.info("Started operation: %s", operation_name)
     
     def end_operation(self, operation_name):
         """
@@ -51,13 +78,52 @@ class PerformanceMonitor:
         Args:
             operation_name (str): Name of the operation
         """
+        end_ns = time.perf_counter_ns()
         end_time = time.time()
-        for op in reversed(self.operation_history):
-            if op["operation"] == operation_name and op["end_time"] is None:
-                op["end_time"] = end_time
-                op["duration"] = end_time - op["start_time"]
-                logging.info(f"Ended operation: {operation_name}, Duration: {op['duration']:.2f} seconds")
-                break
+        open_ops = self._open_ops.get(operation_name)
+        if not open_ops:
+            return
+        
+        # End the most recently started run of this operation
+        op, start_ns = open_ops.pop()
+        if not open_ops:
+            del self._open_ops[operation_name]
+        op["end_time"] = end_time
+        op["duration"] = duration = (end_ns - start_ns) / 1e9
+        
+        # Update the running statistics for this operation
+        op_stats = self._stats.get(operation_name)
+        if op_stats is None:
+            self._stats[operation_name] = {
+                "count": 1,
+                "total_time": duration,
+                "min_time": duration,
+                "max_time": duration
+            }
+        else:
+            op_stats["count"] += 1
+            op_stats["total_time"] += duration
+            if duration < op_stats["min_time"]:
+                op_stats["min_time"] = duration
+            if duration > op_stats["max_time"]:
+                op_stats["max_time"] = duration
+        logging.info("Ended operation: %s, Duration: %.2f seconds", operation_name, op["duration"])
+    
+    @contextmanager
+    def phase(self, operation_name):
+        """
+        Track an operation for the duration of a ``with`` block.
+        
+        The operation is ended even if the block returns early or raises.
+        
+        Args:
+            operation_name (str): Name of the operation
+        """
+        self.start_operation(operation_name)
+        try:
+            yield
+        finally:
+            self.end_operation(operation_name)
     
     def start_monitoring(self):
         """
@@ -65,11 +131,28 @@ class PerformanceMonitor:
         """
         if not self.monitoring:
             self.monitoring = True
+            self._open_usage_log()
             self.monitor_thread = threading.Thread(target=self._monitor_resources)
             self.monitor_thread.daemon = True  # Make thread exit when main program exits
             self.monitor_thread.start()
             logging.info("Started resource monitoring")
     
+    def start_monitoring_async(self):
+        """
+        Start monitoring system resource usage as a task on the running event loop.
+        
+        Must be called from within a coroutine. Use start_monitoring() otherwise.
+        
+        Returns:
+            asyncio.Task: The monitoring task
+        """
+        if not self.monitoring:
+            self.monitoring = True
+            self._open_usage_log()
+            self._monitor_task = asyncio.get_running_loop().create_task(self._monitor_async())
+            logging.info("Started resource monitoring")
+        return self._monitor_task
+    
     def stop_monitoring(self):
         """
         Stop monitoring system resource usage.
@@ -78,54 +161,73 @@ class PerformanceMonitor:
             self.monitoring = False
             if self.monitor_thread:
                 self.monitor_thread.join(timeout=2)  # Wait up to 2 seconds for thread to finish
+            if self._monitor_task and not self._monitor_task.done():
+                self._monitor_task.cancel()
+            if self._usage_fp:
+                self._usage_fp.close()
+                self._usage_fp = None
             logging.info("Stopped resource monitoring")
     
+    def _open_usage_log(self):
+        """
+        Open the NDJSON resource usage log, if one was requested.
+        """
+        if self.usage_log_path and self._usage_fp is None:
+            try:
+                os.makedirs(os.path.dirname(self.usage_log_path) or ".", exist_ok=True)
+                # Line buffered, so every sample reaches the file as it is taken
+                self._usage_fp = open(self.usage_log_path, "a", encoding="utf-8", buffering=1)
+            except OSError as e:
+                logging.error(f"Could not open resource usage log {self.usage_log_path}: {str(e)}")
+    
+    def _sample_resources(self):
+        """
+        Record one resource usage sample.
+        """
+        try:
+            usage = {
+                "timestamp": time.time(),
+                "cpu": self._proc.cpu_percent(None),
+                "memory": psutil.virtual_memory().percent,
+                "disk": psutil.disk_usage('/').percent
+            }
+            self.resource_usage.append(usage)
+            if self._usage_fp:
+                self._usage_fp.write(json.dumps(usage) + "\n")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Resource usage: %s", usage)
+        except Exception as e:
+            logging.error(f"Error monitoring resources: {str(e)}")
+    
     def _monitor_resources(self):
         """
         Monitor system resource usage in a separate thread.
         """
         while self.monitoring:
-            try:
-                usage = {
-                    "timestamp": time.time(),
-                    "cpu": psutil.cpu_percent(interval=None),
-                    "memory": psutil.virtual_memory().percent,
-                    "disk": psutil.disk_usage('/').percent
-                }
-                self.resource_usage.append(usage)
-                logging.debug(f"Resource usage: {usage}")
-            except Exception as e:
-                logging.error(f"Error monitoring resources: {str(e)}")
-            
+            self._sample_resources()
             time.sleep(self.sampling_interval)
     
+    async def _monitor_async(self):
+        """
+        Monitor system resource usage on the event loop.
+        """
+        while self.monitoring:
+            self._sample_resources()
+            await asyncio.sleep(self.sampling_interval)
+    
     def get_operation_stats(self):
         """
         Get statistics about completed operations.
         
+        The statistics are kept up to date as operations end, so they also cover
+        operations that have dropped out of the bounded history.
+        
         Returns:
             dict: Operation statistics
         """
         stats = {}
-        for op in self.operation_history:
-            if op["duration"] is not None:
-                op_name = op["operation"]
-                if op_name not in stats:
-                    stats[op_name] = {
-                        "count": 0,
-                        "total_time": 0,
-                        "min_time": float('inf'),
-                        "max_time": 0
-                    }
-                
-                stats[op_name]["count"] += 1
-                stats[op_name]["total_time"] += op["duration"]
-                stats[op_name]["min_time"] = min(stats[op_name]["min_time"], op["duration"])
-                stats[op_name]["max_time"] = max(stats[op_name]["max_time"], op["duration"])
-        
-        # Calculate averages
-        for op_name in stats:
-            stats[op_name]["avg_time"] = stats[op_name]["total_time"] / stats[op_name]["count"]
+        for op_name, op_stats in self._stats.items():
+            stats[op_name] = dict(op_stats, avg_time=op_stats["total_time"] / op_stats["count"])
         
         return stats
     
@@ -144,20 +246,16 @@ class PerformanceMonitor:
         
         os.makedirs(output_dir, exist_ok=True)
         
-        # Save operation history
         history_path = os.path.join(output_dir, "operation_history.json")
-        with open(history_path, "w", encoding="utf-8") as f:
-            json.dump(list(self.operation_history), f, indent=2)
-        
-        # Save resource usage
         usage_path = os.path.join(output_dir, "resource_usage.json")
-        with open(usage_path, "w", encoding="utf-8") as f:
-            json.dump(self.resource_usage, f, indent=2)
-        
-        # Save operation stats
         stats_path = os.path.join(output_dir, "operation_stats.json")
-        with open(stats_path, "w", encoding="utf-8") as f:
-            json.dump(self.get_operation_stats(), f, indent=2)
+        
+        # Take the snapshots here, then write the three independent files concurrently
+        paths = (history_path, usage_path, stats_path)
+        data = (list(self.operation_history), list(self.resource_usage), self.get_operation_stats())
+        with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+            # Consume the results so that write errors are raised here
+            list(executor.map(write_json, paths, data))
         
         logging.info(f"Saved performance data to {output_dir}")
         return (history_path, usage_path, stats_path)
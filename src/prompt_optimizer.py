@@ -4,35 +4,24 @@ Module for optimizing and refining prompts for story and image generation.
 import json
 import logging
 import os
-from openai import OpenAI
-import sys
-from pathlib import Path
 import time
 
-# Add project root to path for imports
-sys.path.append(str(Path(__file__).parent.parent))
+from typing import List
 
-from config.config import OPENAI_API_KEY, STORY_MODEL
+from pydantic import BaseModel
 
+from config.config import STORY_MODEL
+from src.llm_cache import LLMCache, make_key
+from src.openai_client import get_client
+from src.utils import short_hash, ensure_dir_exists, json_loads, json_dumps, write_json
 
-class PromptOptimizer:
-    def __init__(self):
-        """Initialize the prompt optimizer."""
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.model = STORY_MODEL
-    
-    def analyze_story_quality(self, story_text, original_prompt):
-        """
-        Analyze the quality of a generated story and suggest prompt improvements.
-        
-        Args:
-            story_text (str): The generated story text
-            original_prompt (str): The original prompt used to generate the story
-            
-        Returns:
-            dict: Analysis results with quality metrics and suggested improvements
-        """
-        system_prompt = """
+# Keys under which the model usually returns the optimized image prompts
+_KNOWN_PROMPT_KEYS = ("prompts", "optimized_prompts", "image_prompts", "result", "results")
+
+
+# System prompts are constants, so every request starts with the same bytes and
+# OpenAI's prompt cache can reuse the prefix
+_ANALYZE_SYSTEM_PROMPT = """
         You are an expert children's literature analyst. Your task is to analyze a children's story 
         and provide detailed feedback on its quality, appropriateness, and engagement level for children.
         
@@ -54,7 +43,129 @@ class PromptOptimizer:
         - age_range: Appropriate age range for the story
         - improved_prompt: A refined version of the original prompt
         """
+
+_IMAGE_SYSTEM_PROMPT = """
+        You are an expert in creating prompts for AI image generation, specializing in children's book illustrations.
+        Your task is to analyze a set of image prompts for a children's story and optimize them for:
+        
+        1. Visual clarity and specificity
+        2. Child-friendliness and appropriateness
+        3. Artistic style consistency
+        4. Emotional resonance with the story
+        5. Diversity of scenes and perspectives
+        6. Technical effectiveness for AI image generation
+        
+        For each prompt, provide an optimized version that will result in better illustrations.
+        
+        Return your analysis as a JSON array of optimized prompts.
+        """
+
+_IMAGE_BATCH_SYSTEM_PROMPT = """
+        You are an expert in creating prompts for AI image generation, specializing in children's book illustrations.
+        You will receive several children's stories, each with an id and a set of image prompts. Optimize
+        every prompt for:
+        
+        1. Visual clarity and specificity
+        2. Child-friendliness and appropriateness
+        3. Artistic style consistency
+        4. Emotional resonance with the story
+        5. Diversity of scenes and perspectives
+        6. Technical effectiveness for AI image generation
+        
+        Return a JSON object of the form {"results": [{"id": <story id>, "optimized": [<optimized prompts>]}]}
+        with one entry per story and one optimized prompt per original prompt, in order.
+        """
+
+_ANALYZE_AND_OPTIMIZE_SYSTEM_PROMPT = """
+        You are an expert children's literature analyst and an expert in creating prompts for AI image
+        generation, specializing in children's book illustrations. You have two tasks.
+        
+        Task 1: Analyze the children's story and provide detailed feedback on its quality,
+        appropriateness, and engagement level for children. Analyze the following aspects:
+        1. Age-appropriateness (vocabulary, themes, complexity)
+        2. Narrative structure (beginning, middle, end)
+        3. Character development
+        4. Educational value
+        5. Engagement and entertainment value
+        6. Language quality and readability
+        7. Emotional impact and positive messaging
+        Also suggest specific improvements to the original prompt that would result in a better story.
+        
+        Task 2: Optimize each of the story's image prompts for:
+        1. Visual clarity and specificity
+        2. Child-friendliness and appropriateness
+        3. Artistic style consistency
+        4. Emotional resonance with the story
+        5. Diversity of scenes and perspectives
+        6. Technical effectiveness for AI image generation
+        
+        Return a JSON object with the following fields:
+        - analysis: An object with the fields
+            - overall_rating: A score from 1-10
+            - strengths: List of story strengths
+            - weaknesses: List of story weaknesses
+            - age_range: Appropriate age range for the story
+            - improved_prompt: A refined version of the original prompt
+        - optimized_image_prompts: List with one optimized prompt per original image prompt, in order
+        """
+
+
+class StoryAnalysis(BaseModel):
+    """Schema of a story quality analysis, enforced through structured outputs."""
+    overall_rating: int
+    strengths: List[str]
+    weaknesses: List[str]
+    age_range: str
+    improved_prompt: str
+
+
+class StoryAnalysisWithPrompts(BaseModel):
+    """Schema of the combined response of analyze_and_optimize."""
+    analysis: StoryAnalysis
+    optimized_image_prompts: List[str]
+
+
+def _parsed_response(response):
+    """
+    Get the parsed object of a structured outputs response.
+    
+    Args:
+        response: Response of client.beta.chat.completions.parse
+        
+    Returns:
+        BaseModel: The parsed response
+        
+    Raises:
+        ValueError: If the model refused to answer
+    """
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise ValueError(f"Model returned no parsed response: {message.refusal}")
+    return message.parsed
+
+
+class PromptOptimizer:
+    def __init__(self):
+        """Initialize the prompt optimizer."""
+        self.client = get_client()
+        self.model = STORY_MODEL
+        
+        self._analysis_cache = LLMCache("story_analysis")
+        self._image_cache = LLMCache("image_prompt_optimization")
+        self._batch_cache = LLMCache("image_prompt_optimization_batch")
+        self._combined_cache = LLMCache("analyze_and_optimize")
+    
+    def analyze_story_quality(self, story_text, original_prompt):
+        """
+        Analyze the quality of a generated story and suggest prompt improvements.
         
+        Args:
+            story_text (str): The generated story text
+            original_prompt (str): The original prompt used to generate the story
+            
+        Returns:
+            dict: Analysis results with quality metrics and suggested improvements
+        """
         user_prompt = f"""
         Original Prompt: "{original_prompt}"
         
@@ -64,30 +175,31 @@ class PromptOptimizer:
         Please analyze this children's story and provide detailed feedback.
         """
         
+        cache_key = make_key(self.model, _ANALYZE_SYSTEM_PROMPT, original_prompt, story_text)
+        analysis = self._analysis_cache.get(cache_key)
+        if analysis is not None:
+            logging.info("Using cached story quality analysis")
+            return analysis
+        
         try:
-            response = self.client.chat.completions.create(
+            # Structured outputs make the API return JSON that matches the schema
+            response = self.client.beta.chat.completions.parse(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _ANALYZE_SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
                 ],
-                response_format={"type": "json_object"}
+                response_format=StoryAnalysis
             )
             
-            analysis = json.loads(response.choices[0].message.content)
-            logging.info(f"Story quality analysis completed with overall rating: {analysis.get('overall_rating', 'N/A')}")
+            analysis = _parsed_response(response).model_dump()
+            logging.info(f"Story quality analysis completed with overall rating: {analysis['overall_rating']}")
+            self._analysis_cache.set(cache_key, analysis)
             return analysis
             
         except Exception as e:
             logging.error(f"Error analyzing story quality: {str(e)}")
-            return {
-                "overall_rating": 0,
-                "strengths": [],
-                "weaknesses": ["Error analyzing story"],
-                "age_range": "unknown",
-                "improved_prompt": original_prompt,
-                "error": str(e)
-            }
+            return self._failed_analysis(original_prompt, e)
     
     def optimize_image_prompts(self, story_text, image_prompts):
         """
@@ -100,68 +212,198 @@ class PromptOptimizer:
         Returns:
             list: Optimized image prompts
         """
-        system_prompt = """
-        You are an expert in creating prompts for AI image generation, specializing in children's book illustrations.
-        Your task is to analyze a set of image prompts for a children's story and optimize them for:
-        
-        1. Visual clarity and specificity
-        2. Child-friendliness and appropriateness
-        3. Artistic style consistency
-        4. Emotional resonance with the story
-        5. Diversity of scenes and perspectives
-        6. Technical effectiveness for AI image generation
-        
-        For each prompt, provide an optimized version that will result in better illustrations.
-        
-        Return your analysis as a JSON array of optimized prompts.
-        """
-        
         user_prompt = f"""
         Story Text:
         {story_text}
         
         Original Image Prompts:
-        {json.dumps(image_prompts, indent=2)}
+        {json_dumps(image_prompts, indent=True)}
         
         Please optimize these image prompts for better quality and relevance to the story.
         """
         
+        cache_key = make_key(self.model, _IMAGE_SYSTEM_PROMPT, story_text, json_dumps(image_prompts))
+        optimized_prompts = self._image_cache.get(cache_key)
+        if optimized_prompts is not None:
+            logging.info("Using cached image prompt optimization")
+            return optimized_prompts
+        
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _IMAGE_SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
                 ],
                 response_format={"type": "json_object"}
             )
             
-            result = json.loads(response.choices[0].message.content)
+            result = json_loads(response.choices[0].message.content)
             
-            # Handle different possible response formats
+            # Handle different possible response formats: a bare array, an array under
+            # one of the usual keys, or else the first array in the response
             if isinstance(result, list):
                 optimized_prompts = result
-            elif "prompts" in result:
-                optimized_prompts = result["prompts"]
-            elif "optimized_prompts" in result:
-                optimized_prompts = result["optimized_prompts"]
             else:
-                # Try to find any array in the response
-                for key, value in result.items():
-                    if isinstance(value, list):
-                        optimized_prompts = value
-                        break
-                else:
+                optimized_prompts = next(
+                    (result[key] for key in _KNOWN_PROMPT_KEYS if isinstance(result.get(key), list)),
+                    None
+                ) or next((value for value in result.values() if isinstance(value, list)), None)
+                if optimized_prompts is None:
                     # If no array found, return the original prompts
                     return image_prompts
             
             logging.info(f"Optimized {len(optimized_prompts)} image prompts")
+            self._image_cache.set(cache_key, optimized_prompts)
             return optimized_prompts
             
         except Exception as e:
             logging.error(f"Error optimizing image prompts: {str(e)}")
             return image_prompts
     
+    def optimize_image_prompts_batch(self, items, batch_size=6):
+        """
+        Optimize the image prompts for several stories with one request per batch.
+        
+        Sharing a request between stories saves the round trip and the system
+        prompt tokens per story.
+        
+        Args:
+            items (list): (story_text, image_prompts) tuples
+            batch_size (int): Maximum number of stories per request
+            
+        Returns:
+            list: One list of optimized image prompts per item, in the same order.
+                Items that could not be optimized keep their original prompts.
+        """
+        results = [list(image_prompts) for _, image_prompts in items]
+        cache_keys = [make_key(self.model, _IMAGE_BATCH_SYSTEM_PROMPT, story_text, json_dumps(image_prompts))
+                      for story_text, image_prompts in items]
+        
+        pending = []
+        for i, cache_key in enumerate(cache_keys):
+            cached = self._batch_cache.get(cache_key)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+        
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            stories = [{"id": i, "story": items[i][0], "prompts": items[i][1]} for i in batch]
+            user_prompt = f"""
+        Stories:
+        {json_dumps(stories, indent=True)}
+        
+        Please optimize the image prompts of every story for better quality and relevance to its story.
+        """
+            
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": _IMAGE_BATCH_SYSTEM_PROMPT},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    response_format={"type": "json_object"}
+                )
+                
+                result = json_loads(response.choices[0].message.content)
+                for entry in result.get("results", []):
+                    i = entry.get("id")
+                    optimized_prompts = entry.get("optimized")
+                    # Only accept one string per original prompt, so the number of images stays the same
+                    if (i in batch and isinstance(optimized_prompts, list)
+                            and len(optimized_prompts) == len(items[i][1])
+                            and all(isinstance(prompt, str) for prompt in optimized_prompts)):
+                        results[i] = optimized_prompts
+                        self._batch_cache.set(cache_keys[i], optimized_prompts)
+                
+                logging.info(f"Optimized image prompts for {len(batch)} stories in one request")
+                
+            except Exception as e:
+                logging.error(f"Error optimizing image prompts for {len(batch)} stories: {str(e)}")
+        
+        return results
+    
+    def analyze_and_optimize(self, story_text, original_prompt, image_prompts):
+        """
+        Analyze a story and optimize its image prompts with a single request.
+        
+        This sends the story once instead of once for analyze_story_quality and
+        once for optimize_image_prompts.
+        
+        Args:
+            story_text (str): The generated story text
+            original_prompt (str): The original prompt used to generate the story
+            image_prompts (list): The original image prompts
+            
+        Returns:
+            tuple: (analysis dict as from analyze_story_quality, list of optimized image prompts)
+        """
+        user_prompt = f"""
+        Original Prompt: "{original_prompt}"
+        
+        Generated Story:
+        {story_text}
+        
+        Original Image Prompts:
+        {json_dumps(image_prompts, indent=True)}
+        
+        Please analyze this children's story and optimize its image prompts.
+        """
+        
+        # Only exact matches, as the result includes prompts for this exact scene list
+        cache_key = make_key(self.model, _ANALYZE_AND_OPTIMIZE_SYSTEM_PROMPT, original_prompt, story_text,
+                             json_dumps(image_prompts))
+        cached = self._combined_cache.get(cache_key)
+        if cached is not None:
+            logging.info("Using cached story analysis and image prompt optimization")
+            return cached["analysis"], cached["optimized_image_prompts"]
+        
+        try:
+            response = self.client.beta.chat.completions.parse(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": _ANALYZE_AND_OPTIMIZE_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt}
+                ],
+                response_format=StoryAnalysisWithPrompts
+            )
+            
+            result = _parsed_response(response).model_dump()
+            analysis = result["analysis"]
+            optimized_prompts = result["optimized_image_prompts"]
+            
+            logging.info(f"Story quality analysis completed with overall rating: {analysis['overall_rating']}")
+            logging.info(f"Optimized {len(optimized_prompts)} image prompts")
+            self._combined_cache.set(cache_key, result)
+            return analysis, optimized_prompts
+            
+        except Exception as e:
+            logging.error(f"Error analyzing story and optimizing image prompts: {str(e)}")
+            return self._failed_analysis(original_prompt, e), image_prompts
+    
+    def _failed_analysis(self, original_prompt, error):
+        """
+        Build the analysis result returned when the analysis request fails.
+        
+        Args:
+            original_prompt (str): The original story prompt
+            error (Exception): The error that occurred
+            
+        Returns:
+            dict: Analysis with the same fields as a successful one
+        """
+        return {
+            "overall_rating": 0,
+            "strengths": [],
+            "weaknesses": ["Error analyzing story"],
+            "age_range": "unknown",
+            "improved_prompt": original_prompt,
+            "error": str(error)
+        }
+    
     def save_optimization_results(self, analysis, original_prompt, story_text, output_dir):
         """
         Save optimization results to a file for future reference.
@@ -175,25 +417,24 @@ class PromptOptimizer:
         Returns:
             str: Path to the saved file
         """
-        os.makedirs(output_dir, exist_ok=True)
+        ensure_dir_exists(output_dir)
         
         # Create filename based on prompt
-        import hashlib
-        prompt_hash = hashlib.md5(original_prompt.encode()).hexdigest()[:8]
+        prompt_hash = short_hash(original_prompt)
         filename = f"optimization_{prompt_hash}.json"
         filepath = os.path.join(output_dir, filename)
         
-        # Prepare data to save
+        # Prepare data to save; short stories are stored as they are
+        excerpt = story_text if len(story_text) <= 500 else story_text[:500] + "..."
         data = {
             "original_prompt": original_prompt,
-            "story_excerpt": story_text[:500] + "..." if len(story_text) > 500 else story_text,
+            "story_excerpt": excerpt,
             "analysis": analysis,
             "timestamp": str(time.time())
         }
         
         # Save to file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        write_json(filepath, data)
         
         logging.info(f"Saved optimization results to {filepath}")
         return filepath
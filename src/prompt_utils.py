@@ -0,0 +1,44 @@
+"""
+Helper functions shared by the modules that build image prompts.
+"""
+import re
+from functools import lru_cache
+
+SAFETY_INSTRUCTIONS = (
+    "Create a child-friendly, G-rated illustration suitable for young children. "
+    "Use bright, cheerful colors and a non-threatening style. "
+    "Ensure all content is age-appropriate for children ages 4-10. "
+)
+
+DEFAULT_STYLE = " Style: children's book illustration, colorful, whimsical."
+
+_STYLE_RE = re.compile(r"style\s*[:=]", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def apply_safety_wrapper(prompt):
+    """
+    Add child-safety instructions to an image prompt.
+
+    The wrapper is applied only once, so prompts that already passed through
+    the content filter are returned unchanged by the image generator. Results
+    are memoized, as the same prompt goes through both steps.
+
+    Args:
+        prompt (str): The image prompt
+
+    Returns:
+        str: Prompt with safety instructions
+    """
+    if SAFETY_INSTRUCTIONS in prompt:
+        return prompt
+
+    # Check if the prompt already has style instructions
+    match = _STYLE_RE.search(prompt)
+    if match:
+        # Insert safety instructions before style instructions, slicing at the
+        # match instead of scanning the prompt again with split()
+        return prompt[:match.start()] + SAFETY_INSTRUCTIONS + "Style:" + prompt[match.end():]
+
+    # Add safety instructions and style guidance
+    return SAFETY_INSTRUCTIONS + prompt + DEFAULT_STYLE
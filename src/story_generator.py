@@ -2,41 +2,76 @@
 Module for generating children's stories using OpenAI's GPT API.
 """
 import time
-import sys
-from openai import OpenAI
+import asyncio
+from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
 from openai import APIError, RateLimitError, APIConnectionError
 import logging
 
-# Import configuration
-sys.path.append(".")
-from config.config import OPENAI_API_KEY, STORY_MODEL, STORY_MAX_TOKENS, STORY_TEMPERATURE
+from config.config import OPENAI_API_KEY, STORY_MODEL, STORY_MAX_TOKENS, STORY_TEMPERATURE, STORY_NOCACHE
+from src.llm_cache import LLMCache, make_key
+from src.openai_client import get_client
+from src.utils import ensure_story_title
+
+
+# System prompts are constants, so every request starts with the same bytes and
+# OpenAI's prompt cache can reuse the prefix
+_STORY_SYSTEM_PROMPT = """
+        You are a creative children's story writer. Create an engaging, age-appropriate story for children 
+        aged 4-10 years old based on the provided prompt. The story should:
+        
+        1. Be 500-1000 words long
+        2. Have a clear beginning, middle, and end
+        3. Include 1-3 main characters with distinct personalities
+        4. Contain positive messages or lessons
+        5. Use simple language appropriate for children
+        6. Be engaging, imaginative, and fun
+        7. Avoid any scary, violent, or inappropriate content
+        8. Format the story in markdown with a title using # and paragraphs
+        
+        Return ONLY the story text in markdown format, with no additional explanations or notes.
+        """
+
+
+class StreamInterruptedError(Exception):
+    """Raised when a story stream fails after part of it reached the on_chunk callback."""
 
 
 class StoryGenerator:
-    def __init__(self, model=None, temperature=None):
+    def __init__(self, model=None, temperature=None, use_cache=False):
         """
         Initialize the story generator with API client and parameters.
         
         Args:
             model (str, optional): Custom model to use. If None, uses default.
             temperature (float, optional): Creativity level. If None, uses default.
+            use_cache (bool): Whether to reuse stories generated earlier for the same
+                request, for repeated runs such as the test runner. STORY_NOCACHE=1
+                turns the cache off regardless.
         """
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = get_client()
+        self._aclient = None
+        self._aclient_loop = None
         self.model = model if model else STORY_MODEL
         self.max_tokens = STORY_MAX_TOKENS
         self.temperature = temperature if temperature is not None else STORY_TEMPERATURE
         self.max_retries = 3
         self.retry_delay = 5  # seconds
+        self._story_cache = LLMCache("stories") if use_cache and not STORY_NOCACHE else None
         
         logging.debug(f"Initialized StoryGenerator with model={self.model}, temperature={self.temperature}")
     
-    def generate_story(self, prompt):
+    def generate_story(self, prompt, on_chunk=None):
         """
         Generate a children's story based on the provided prompt.
         
         Args:
             prompt (str): User's story idea or theme
+            on_chunk (callable, optional): If provided, the story is streamed and this
+                callback receives each text fragment as it arrives. If a stream breaks
+                off after some fragments were delivered, the story is requested again
+                without streaming, so the callback never receives text twice and the
+                returned story may not end with the delivered fragments.
             
         Returns:
             str: Generated story in markdown format
@@ -44,58 +79,44 @@ class StoryGenerator:
         Raises:
             Exception: If story generation fails after retries
         """
-        # Create the system prompt for story generation
-        system_prompt = """
-        You are a creative children's story writer. Create an engaging, age-appropriate story for children 
-        aged 4-10 years old based on the provided prompt. The story should:
-        
-        1. Be 500-1000 words long
-        2. Have a clear beginning, middle, and end
-        3. Include 1-3 main characters with distinct personalities
-        4. Contain positive messages or lessons
-        5. Use simple language appropriate for children
-        6. Be engaging, imaginative, and fun
-        7. Avoid any scary, violent, or inappropriate content
-        8. Format the story in markdown with a title using # and paragraphs
-        
-        Return ONLY the story text in markdown format, with no additional explanations or notes.
-        """
+        messages = self._build_messages(prompt)
         
-        # Enhanced user prompt with specific instructions
-        user_prompt = f"""
-        Create a children's story based on this idea: "{prompt}"
+        cache_key, story = self._cached_story(messages)
+        if story is not None:
+            if on_chunk is not None:
+                on_chunk(story)
+            return story
         
-        Make the story whimsical, educational, and engaging for young readers.
-        Include descriptive scenes that would work well as illustrations.
-        """
+        stream = on_chunk is not None
         
         # Attempt to generate the story with retries
         for attempt in range(self.max_retries):
             try:
                 print(f"Generating your children's story... (attempt {attempt + 1})")
                 
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_tokens=self.max_tokens,
-                    temperature=self.temperature
-                )
-                
-                # Extract the story from the response
-                story = response.choices[0].message.content.strip()
-                
-                # Ensure the story has a title
-                if not story.startswith("# "):
-                    # Extract a title from the first line or add a generic one
-                    first_line = story.split("\n")[0]
-                    title = first_line if len(first_line) < 50 else "My Children's Story"
-                    story = f"# {title}\n\n{story}"
+                if stream:
+                    story = self._stream_story(messages, on_chunk)
+                else:
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=self.max_tokens,
+                        temperature=self.temperature
+                    )
+                    
+                    # Extract the story from the response
+                    story = response.choices[0].message.content.strip()
                 
+                story = ensure_story_title(story)
+                self._store_story(cache_key, story)
                 return story
                 
+            except StreamInterruptedError as e:
+                # The callback already has part of the story, so retry without streaming
+                print(f"{str(e)}. Retrying in {self.retry_delay} seconds...")
+                stream = False
+                time.sleep(self.retry_delay)
+                
             except RateLimitError:
                 print(f"Rate limit exceeded. Waiting {self.retry_delay} seconds before retrying...")
                 time.sleep(self.retry_delay)
@@ -112,6 +133,161 @@ class StoryGenerator:
                 time.sleep(self.retry_delay)
         
         raise Exception(f"Failed to generate story after {self.max_retries} attempts")
+    
+    async def generate_story_async(self, prompt):
+        """
+        Generate a children's story without blocking the event loop.
+        
+        Several stories can be generated concurrently with asyncio.gather().
+        
+        Args:
+            prompt (str): User's story idea or theme
+            
+        Returns:
+            str: Generated story in markdown format
+            
+        Raises:
+            Exception: If story generation fails after retries
+        """
+        messages = self._build_messages(prompt)
+        
+        cache_key, story = self._cached_story(messages)
+        if story is not None:
+            return story
+        
+        # Concurrent requests each back off on their own instead of sharing self.retry_delay
+        retry_delay = self.retry_delay
+        
+        for attempt in range(self.max_retries):
+            try:
+                response = await self._get_async_client().chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature
+                )
+                
+                story = ensure_story_title(response.choices[0].message.content.strip())
+                self._store_story(cache_key, story)
+                return story
+                
+            except RateLimitError:
+                print(f"Rate limit exceeded. Waiting {retry_delay} seconds before retrying...")
+                await asyncio.sleep(retry_delay)
+                retry_delay *= 2  # Exponential backoff
+                
+            except (APIError, APIConnectionError) as e:
+                print(f"API error: {str(e)}. Retrying in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+                
+            except Exception as e:
+                print(f"Unexpected error: {str(e)}")
+                if attempt == self.max_retries - 1:
+                    raise Exception(f"Failed to generate story after {self.max_retries} attempts: {str(e)}")
+                await asyncio.sleep(retry_delay)
+        
+        raise Exception(f"Failed to generate story after {self.max_retries} attempts")
+    
+    def _get_async_client(self):
+        """Get the async client, creating a new one when the event loop has changed."""
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+            self._aclient_loop = loop
+        return self._aclient
+    
+    async def aclose(self):
+        """Close the async client before its event loop ends."""
+        if self._aclient is not None:
+            aclient, self._aclient, self._aclient_loop = self._aclient, None, None
+            await aclient.close()
+    
+    def _build_messages(self, prompt):
+        """
+        Build the chat messages for a story generation request.
+        
+        Args:
+            prompt (str): User's story idea or theme
+            
+        Returns:
+            list: System and user messages
+        """
+        # Enhanced user prompt with specific instructions
+        user_prompt = f"""
+        Create a children's story based on this idea: "{prompt}"
+        
+        Make the story whimsical, educational, and engaging for young readers.
+        Include descriptive scenes that would work well as illustrations.
+        """
+        
+        messages = [
+            {"role": "system", "content": _STORY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+        return messages
+    
+    def _cached_story(self, messages):
+        """
+        Look up a story generated earlier for the same request.
+        
+        Args:
+            messages (list): Chat messages for the completion request
+            
+        Returns:
+            tuple: (cache key, cached story or None)
+        """
+        if self._story_cache is None:
+            return None, None
+        
+        cache_key = make_key(self.model, str(self.temperature), str(self.max_tokens),
+                             *(message["content"] for message in messages))
+        story = self._story_cache.get(cache_key)
+        if story is not None:
+            logging.info("Using cached story")
+        return cache_key, story
+    
+    def _store_story(self, cache_key, story):
+        """Store a generated story under the key from _cached_story."""
+        if cache_key is not None:
+            self._story_cache.set(cache_key, story)
+    
+    def _stream_story(self, messages, on_chunk):
+        """
+        Stream a story completion, forwarding each text fragment to a callback.
+        
+        Args:
+            messages (list): Chat messages for the completion request
+            on_chunk (callable): Called with each text fragment as it arrives
+            
+        Returns:
+            str: The complete story text
+            
+        Raises:
+            StreamInterruptedError: If the stream fails after the first fragment was forwarded
+        """
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+            stream=True
+        )
+        
+        fragments = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    fragments.append(delta)
+                    on_chunk(delta)
+        except Exception as e:
+            if fragments:
+                raise StreamInterruptedError(f"Story stream failed after {len(fragments)} fragments: {str(e)}") from e
+            raise
+        
+        return "".join(fragments).strip()
 
 
 if __name__ == "__main__":
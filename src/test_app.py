@@ -2,24 +2,46 @@
 Module for testing the AI Children's Story Generator with various inputs.
 """
 import os
-import sys
 import time
+import asyncio
 import logging
-from pathlib import Path
-
-# Add project root to path for imports
-sys.path.append(str(Path(__file__).parent.parent))
 
 from src.input_handler import InputHandler
 from src.story_generator import StoryGenerator
 from src.image_prompt_creator import ImagePromptCreator
 from src.image_generator import ImageGenerator
 from src.file_manager import FileManager
-from src.utils import setup_logging, print_colored
-from config.config import OUTPUT_DIR
+from src.prompt_optimizer import PromptOptimizer
+from src.utils import setup_logging, print_colored, ensure_dir_exists
+from config.config import OUTPUT_DIR, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_MINUTE
+
 
+class _RateLimiter:
+    def __init__(self, requests_per_minute):
+        """
+        Initialize a token bucket that spaces out API requests.
+        
+        Args:
+            requests_per_minute (int): Sustained request rate; also the burst size
+        """
+        self.capacity = requests_per_minute
+        self.rate = requests_per_minute / 60  # tokens per second
+        self.tokens = requests_per_minute
+        self.updated = time.monotonic()
+    
+    async def acquire(self):
+        """Wait until a request may be sent."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
-def run_tests(test_inputs=None, save_results=True, verbose=True):
+
+def run_tests(test_inputs=None, save_results=True, verbose=True, optimize_prompts=False):
     """
     Run tests on the story generator with various inputs.
     
@@ -27,6 +49,8 @@ def run_tests(test_inputs=None, save_results=True, verbose=True):
         test_inputs (list, optional): List of test prompts. If None, uses default test cases.
         save_results (bool): Whether to save the generated stories and images.
         verbose (bool): Whether to print detailed output.
+        optimize_prompts (bool): Whether to optimize the image prompts; the prompts of
+            all tests are collected first and optimized in one batched call.
         
     Returns:
         dict: Test results summary
@@ -44,18 +68,15 @@ def run_tests(test_inputs=None, save_results=True, verbose=True):
             "A group of kids who work together to save their town from a flood using teamwork and creativity"
         ]
     
-    # Initialize components
-    input_handler = InputHandler()
-    story_generator = StoryGenerator()
-    image_prompt_creator = ImagePromptCreator()
-    image_generator = ImageGenerator()
-    
     # Create test output directory
     test_output_dir = os.path.join(OUTPUT_DIR, "test_results")
     if save_results:
-        os.makedirs(test_output_dir, exist_ok=True)
+        ensure_dir_exists(test_output_dir)
     
-    file_manager = FileManager(custom_output_dir=test_output_dir if save_results else None)
+    # Run tests
+    print_colored("\n===== Running Story Generator Tests =====\n", "cyan")
+    
+    test_details = asyncio.run(_run_tests_async(test_inputs, test_output_dir, save_results, verbose, optimize_prompts))
     
     # Track test results
     results = {
@@ -66,26 +87,112 @@ def run_tests(test_inputs=None, save_results=True, verbose=True):
         "image_generation_times": [],
         "total_images_generated": 0,
         "average_story_length": 0,
-        "test_details": []
+        "test_details": test_details
     }
     
-    # Run tests
-    print_colored("\n===== Running Story Generator Tests =====\n", "cyan")
-    
     total_story_length = 0
+    # Averages come from running sums of the integer nanosecond durations
+    story_ns_sum = story_ns_count = 0
+    image_ns_sum = image_ns_count = 0
     
-    for i, test_input in enumerate(test_inputs, 1):
-        print_colored(f"Test {i}/{len(test_inputs)}: {test_input}", "blue")
+    for test_result in test_details:
+        if test_result["success"]:
+            results["successful_tests"] += 1
+        else:
+            results["failed_tests"] += 1
+        if test_result["story_ns"] is not None:
+            story_ns_sum += test_result["story_ns"]
+            story_ns_count += 1
+            results["story_generation_times"].append(test_result["story_time"])
+        if test_result["image_ns"] is not None:
+            image_ns_sum += test_result["image_ns"]
+            image_ns_count += 1
+            results["image_generation_times"].append(test_result["image_time"])
+        results["total_images_generated"] += test_result["num_images"]
+        total_story_length += test_result["story_length"]
+    
+    # Calculate averages
+    if story_ns_count:
+        results["average_story_time"] = story_ns_sum / story_ns_count / 1e9
+    
+    if image_ns_count:
+        results["average_image_time"] = image_ns_sum / image_ns_count / 1e9
+    
+    if total_story_length > 0:
+        results["average_story_length"] = total_story_length / results["total_tests"]
+    
+    # Print summary
+    print_colored("\n===== Test Results Summary =====\n", "cyan")
+    print(f"Total tests: {results['total_tests']}")
+    print(f"Successful: {results['successful_tests']}")
+    print(f"Failed: {results['failed_tests']}")
+    
+    if results["story_generation_times"]:
+        print(f"Average story generation time: {results['average_story_time']:.2f} seconds")
+    
+    if results["image_generation_times"]:
+        print(f"Average image generation time: {results['average_image_time']:.2f} seconds")
+    
+    if "average_story_length" in results:
+        print(f"Average story length: {results['average_story_length']:.0f} words")
+    
+    print(f"Total images generated: {results['total_images_generated']}")
+    
+    return results
+
+
+async def _run_tests_async(test_inputs, test_output_dir, save_results, verbose, optimize_prompts):
+    """
+    Run the tests concurrently, limited by the configured request concurrency and rate.
+    
+    Args:
+        test_inputs (list): List of test prompts
+        test_output_dir (str): Directory the test stories are saved to
+        save_results (bool): Whether to save the generated stories and images.
+        verbose (bool): Whether to print detailed output.
+        optimize_prompts (bool): Whether to optimize the image prompts.
         
+    Returns:
+        list: One test result per prompt, in the same order
+    """
+    # Initialize components
+    input_handler = InputHandler()
+    # Repeated test runs reuse the stories of earlier runs
+    story_generator = StoryGenerator(use_cache=True)
+    image_prompt_creator = ImagePromptCreator()
+    image_generator = ImageGenerator()
+    file_manager = FileManager(custom_output_dir=test_output_dir if save_results else None)
+    
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    rate_limiter = _RateLimiter(REQUESTS_PER_MINUTE)
+    
+    async def limited(make_request, *args):
+        """Send one API request once a concurrency slot and a rate limit token are free."""
+        async with semaphore:
+            await rate_limiter.acquire()
+            return await make_request(*args)
+    
+    def in_thread(func, *args):
+        """Run a blocking call in the default executor."""
+        return loop.run_in_executor(None, func, *args)
+    
+    async def prepare(i, test_input):
+        """Generate and save one test story and extract its image prompts."""
         test_result = {
             "prompt": test_input,
             "success": False,
             "story_time": 0,
+            "story_ns": None,
             "image_time": 0,
+            "image_ns": None,
             "num_images": 0,
             "story_length": 0,
             "error": None
         }
+        # Output is collected and printed at once, so concurrent tests don't interleave
+        lines = []
+        job = None
         
         try:
             # Validate input
@@ -94,24 +201,24 @@ def run_tests(test_inputs=None, save_results=True, verbose=True):
                 raise ValueError(f"Invalid input: {validation['message']}")
             
             # Generate story
-            start_time = time.time()
-            story = story_generator.generate_story(test_input)
-            story_time = time.time() - start_time
+            start_ns = time.monotonic_ns()
+            story = await limited(story_generator.generate_story_async, test_input)
+            story_ns = time.monotonic_ns() - start_ns
+            story_time = story_ns / 1e9
+            test_result["story_ns"] = story_ns
             test_result["story_time"] = story_time
-            results["story_generation_times"].append(story_time)
             
             # Calculate story length
             story_length = len(story.split())
             test_result["story_length"] = story_length
-            total_story_length += story_length
             
             if verbose:
-                print(f"  - Story generated in {story_time:.2f} seconds ({story_length} words)")
+                lines.append(f"  - Story generated in {story_time:.2f} seconds ({story_length} words)")
             
             # Save story if requested
             if save_results:
                 # Extract title
-                title_line = story.split('\n')[0]
+                title_line = story.partition('\n')[0]
                 title = title_line[2:] if title_line.startswith('# ') else "Test Story"
                 
                 # Create folder and save story
@@ -119,67 +226,83 @@ def run_tests(test_inputs=None, save_results=True, verbose=True):
                 markdown_path = file_manager.save_story_markdown(story, folder_path)
                 
                 # Generate image prompts
-                image_prompts = image_prompt_creator.extract_scenes(story)
+                image_prompts = await limited(image_prompt_creator.extract_scenes_async, story)
+                job = {
+                    "story": story,
+                    "image_prompts": image_prompts,
+                    "folder_path": folder_path,
+                    "markdown_path": markdown_path
+                }
+            else:
+                test_result["success"] = True
+            
+        except Exception as e:
+            test_result["error"] = str(e)
+            logging.error(f"Test {i} failed: {str(e)}", exc_info=True)
+        
+        return test_result, lines, job
+    
+    async def finish(i, test_input, test_result, lines, job):
+        """Generate the images of one prepared test and print its output."""
+        if job:
+            try:
+                folder_path = job["folder_path"]
                 
-                # Generate images
-                start_time = time.time()
-                image_paths = image_generator.generate_images(image_prompts, folder_path)
-                image_time = time.time() - start_time
+                # Generate images; each image is its own request, so the images of all
+                # tests together stay within the concurrency and rate limits
+                start_ns = time.monotonic_ns()
+                image_results = await asyncio.gather(*(
+                    limited(in_thread, image_generator.generate_single_image, prompt, folder_path, number)
+                    for number, prompt in enumerate(job["image_prompts"], 1)
+                ))
+                image_paths = [image_path for image_path in image_results if image_path]
+                image_ns = time.monotonic_ns() - start_ns
+                image_time = image_ns / 1e9
+                test_result["image_ns"] = image_ns
                 test_result["image_time"] = image_time
-                results["image_generation_times"].append(image_time)
                 
                 # Update markdown with images
                 if image_paths:
-                    file_manager.update_markdown_with_images(markdown_path, image_paths)
+                    file_manager.update_markdown_with_images(job["markdown_path"], image_paths)
                     test_result["num_images"] = len(image_paths)
-                    results["total_images_generated"] += len(image_paths)
                 
                 if verbose:
-                    print(f"  - Generated {len(image_paths)} images in {image_time:.2f} seconds")
-                    print(f"  - Saved to: {folder_path}")
-            
-            test_result["success"] = True
-            results["successful_tests"] += 1
-            print_colored("  - Test passed successfully", "green")
-            
-        except Exception as e:
-            test_result["error"] = str(e)
-            results["failed_tests"] += 1
-            print_colored(f"  - Test failed: {str(e)}", "red")
-            logging.error(f"Test {i} failed: {str(e)}", exc_info=True)
+                    lines.append(f"  - Generated {len(image_paths)} images in {image_time:.2f} seconds")
+                    lines.append(f"  - Saved to: {folder_path}")
+                
+                test_result["success"] = True
+                
+            except Exception as e:
+                test_result["error"] = str(e)
+                logging.error(f"Test {i} failed: {str(e)}", exc_info=True)
         
-        results["test_details"].append(test_result)
+        print_colored(f"Test {i}/{len(test_inputs)}: {test_input}", "blue")
+        for line in lines:
+            print(line)
+        if test_result["success"]:
+            print_colored("  - Test passed successfully", "green")
+        else:
+            print_colored(f"  - Test failed: {test_result['error']}", "red")
         print("")
+        return test_result
     
-    # Calculate averages
-    if results["story_generation_times"]:
-        results["average_story_time"] = sum(results["story_generation_times"]) / len(results["story_generation_times"])
-    
-    if results["image_generation_times"]:
-        results["average_image_time"] = sum(results["image_generation_times"]) / len(results["image_generation_times"])
-    
-    if total_story_length > 0:
-        results["average_story_length"] = total_story_length / results["total_tests"]
-    
-    # Print summary
-    print_colored("\n===== Test Results Summary =====\n", "cyan")
-    print(f"Total tests: {results['total_tests']}")
-    print(f"Successful: {results['successful_tests']}")
-    print(f"Failed: {results['failed_tests']}")
-    
-    if results["story_generation_times"]:
-        print(f"Average story generation time: {results['average_story_time']:.2f} seconds")
-    
-    if results["image_generation_times"]:
-        print(f"Average image generation time: {results['average_image_time']:.2f} seconds")
-    
-    if "average_story_length" in results:
-        print(f"Average story length: {results['average_story_length']:.0f} words")
-    
-    print(f"Total images generated: {results['total_images_generated']}")
-    
-    return results
-
+    try:
+        prepared = await asyncio.gather(*(prepare(i, test_input) for i, test_input in enumerate(test_inputs, 1)))
+        
+        # All image prompts are collected first, so one batched call optimizes every test's prompts
+        jobs = [job for _, _, job in prepared if job]
+        if optimize_prompts and jobs:
+            items = [(job["story"], job["image_prompts"]) for job in jobs]
+            optimized = await limited(in_thread, PromptOptimizer().optimize_image_prompts_batch, items)
+            for job, image_prompts in zip(jobs, optimized):
+                job["image_prompts"] = image_prompts
+        
+        return await asyncio.gather(*(
+            finish(i, test_input, *prepared[i - 1]) for i, test_input in enumerate(test_inputs, 1)
+        ))
+    finally:
+        await story_generator.aclose()
+        await image_prompt_creator.aclose()
 
 if __name__ == "__main__":
     # Run tests with default inputs
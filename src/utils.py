@@ -4,10 +4,17 @@ Utility functions for the AI Children's Story Generator.
 import re
 import os
 import sys
+import json
+import hashlib
 import logging
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    # Optional dependency; fall back to the standard json module
+    orjson = None
 
 # ANSI color codes for terminal output
 COLORS = {
@@ -22,6 +29,49 @@ COLORS = {
     "reset": "\033[0m"
 }
 
+# Assuming this file is in src/utils.py; computed once at import
+_PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+
+# Patterns used by the text helpers below, compiled once
+_TITLE_RE = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+_INVALID_FN = re.compile(r'[\\/*?:"<>|]')
+_SPACE_DASH = re.compile(r'[\s\-]+')
+# Markdown headers, images and links, removed in a single pass when counting words
+_MARKDOWN_STRIP = re.compile(r'#+ |!\[.*?\]\(.*?\)|\[.*?\]\(.*?\)')
+
+_RESET = COLORS["reset"]
+
+# Prefix and suffix written around colored text; empty when colors are off
+_NO_WRAP = ("", "")
+_COLOR_WRAP = {color: (code, _RESET) for color, code in COLORS.items()}
+
+# The stdout stream the terminal check was last made for, and its result
+_checked_stream = None
+_stream_is_tty = False
+
+
+def colors_enabled():
+    """
+    Check whether output to stdout should be colored.
+    
+    Colors are only used in a terminal. The check is made on first use and
+    again only after sys.stdout is replaced.
+    
+    Returns:
+        bool: True if stdout is a terminal
+    """
+    global _checked_stream, _stream_is_tty
+    stream = sys.stdout
+    if stream is not _checked_stream:
+        isatty = getattr(stream, "isatty", None)
+        try:
+            _stream_is_tty = bool(isatty and isatty())
+        except ValueError:
+            # stdout has been closed
+            _stream_is_tty = False
+        _checked_stream = stream
+    return _stream_is_tty
+
 
 def print_colored(text, color="reset"):
     """
@@ -31,10 +81,11 @@ def print_colored(text, color="reset"):
         text (str): The text to print
         color (str): The color to use
     """
-    if color in COLORS and sys.stdout.isatty():  # Only use colors in a terminal
-        print(f"{COLORS[color]}{text}{COLORS['reset']}")
-    else:
-        print(text)
+    if sys.stdout is None:
+        # No console (pythonw, some service runners); print() drops the text as well
+        return
+    prefix, suffix = _COLOR_WRAP.get(color, _NO_WRAP) if colors_enabled() else _NO_WRAP
+    sys.stdout.write(f"{prefix}{text}{suffix}\n")
 
 
 def setup_logging(level="INFO", log_file=None):
@@ -44,13 +95,19 @@ def setup_logging(level="INFO", log_file=None):
     Args:
         level (str): Logging level (DEBUG, INFO, WARNING, ERROR)
         log_file (str, optional): Path to log file. If None, logs to a default file.
+    
+    Logging is only configured once per process; later calls return immediately.
     """
+    # basicConfig would ignore the new handlers anyway, so don't create them
+    if logging.getLogger().handlers:
+        return
+    
     # Convert string level to logging level
     numeric_level = getattr(logging, level.upper(), logging.INFO)
     
     # Create logs directory if it doesn't exist
     logs_dir = os.path.join(get_project_root(), "logs")
-    os.makedirs(logs_dir, exist_ok=True)
+    ensure_dir_exists(logs_dir)
     
     # Generate default log filename if not provided
     if not log_file:
@@ -62,7 +119,8 @@ def setup_logging(level="INFO", log_file=None):
         level=numeric_level,
         format="%(asctime)s [%(levelname)s] %(message)s",
         handlers=[
-            logging.FileHandler(log_file),
+            # The file is opened on the first record instead of here
+            logging.FileHandler(log_file, delay=True),
             logging.StreamHandler() if level.upper() == "DEBUG" else logging.NullHandler()
         ]
     )
@@ -81,12 +139,12 @@ def extract_title_from_markdown(markdown_text):
         str: The extracted title
     """
     # Look for a markdown title
-    title_match = re.search(r'^#\s+(.+)$', markdown_text, re.MULTILINE)
+    title_match = _TITLE_RE.search(markdown_text)
     if title_match:
         return title_match.group(1).strip()
     
     # If no markdown title, use the first line
-    first_line = markdown_text.split('\n')[0].strip()
+    first_line = markdown_text.partition('\n')[0].strip()
     if first_line:
         return first_line
     
@@ -94,6 +152,25 @@ def extract_title_from_markdown(markdown_text):
     return "Children's Story"
 
 
+def ensure_story_title(story):
+    """
+    Make sure a generated story starts with a markdown title.
+    
+    Args:
+        story (str): The generated story text
+        
+    Returns:
+        str: Story text with a title
+    """
+    if not story.startswith("# "):
+        # Extract a title from the first line or add a generic one
+        first_line = story.partition("\n")[0]
+        title = first_line if len(first_line) < 50 else "My Children's Story"
+        story = f"# {title}\n\n{story}"
+    
+    return story
+
+
 def clean_filename(text):
     """
     Clean text to make it suitable for a filename.
@@ -105,10 +182,10 @@ def clean_filename(text):
         str: Cleaned text
     """
     # Replace invalid filename characters
-    text = re.sub(r'[\\/*?:"<>|]', '', text)
+    text = _INVALID_FN.sub('', text)
     
     # Replace spaces and other characters with underscores
-    text = re.sub(r'[\s\-]+', '_', text)
+    text = _SPACE_DASH.sub('_', text)
     
     # Limit length
     text = text[:50]
@@ -130,8 +207,7 @@ def get_project_root():
     Returns:
         str: Path to the project root
     """
-    # Assuming this file is in src/utils.py
-    return str(Path(__file__).parent.parent)
+    return _PROJECT_ROOT
 
 
 def ensure_dir_exists(directory):
@@ -144,6 +220,11 @@ def ensure_dir_exists(directory):
     Returns:
         bool: True if successful, False otherwise
     """
+    # An existing directory costs a single stat; it is checked on every call, as
+    # output directories may be removed while the program runs
+    if os.path.isdir(directory):
+        return True
+    
     try:
         os.makedirs(directory, exist_ok=True)
         return True
@@ -162,14 +243,64 @@ def count_words(text):
     Returns:
         int: Number of words
     """
-    # Remove markdown formatting
-    clean_text = re.sub(r'#+ ', '', text)  # Remove headers
-    clean_text = re.sub(r'!\[.*?\]\(.*?\)', '', clean_text)  # Remove images
-    clean_text = re.sub(r'\[.*?\]\(.*?\)', '', clean_text)  # Remove links
+    # Remove markdown headers, images and links, then split by whitespace and count
+    return len(_MARKDOWN_STRIP.sub('', text).split())
+
+
+def short_hash(text, length=8):
+    """
+    Build a short fingerprint of a text, e.g. for file names.
+    
+    Always uses BLAKE2b, so the same text gets the same fingerprint on every machine.
     
-    # Split by whitespace and count
-    words = clean_text.split()
-    return len(words)
+    Args:
+        text (str): The text to fingerprint
+        length (int): Number of hex characters to return (even)
+        
+    Returns:
+        str: Hex digest of the given length
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=length // 2).hexdigest()
+
+
+def json_loads(text):
+    """Parse a JSON document, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def json_dumps(data, indent=False):
+    """
+    Serialize data to a JSON string, using orjson when it is installed.
+    
+    Args:
+        data: JSON-serializable data
+        indent (bool): Whether to indent the output by two spaces
+        
+    Returns:
+        str: The JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else None).decode("utf-8")
+    # Keep non-ASCII text as UTF-8 like orjson does, rather than \uXXXX escapes
+    return json.dumps(data, indent=2 if indent else None, ensure_ascii=False)
+
+
+def write_json(path, data):
+    """
+    Write data to a file as indented UTF-8 JSON, using orjson when it is installed.
+    
+    Args:
+        path (str): Path to the output file
+        data: JSON-serializable data
+    """
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
 
 
 def format_time(seconds):